@@ -1,9 +1,5 @@
 #!/usr/bin/env python3
-import tkinter as tk
-from tkinter import ttk
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.figure import Figure
+import argparse
 import threading
 import time
 import socket
@@ -12,9 +8,27 @@ import struct
 import random
 from datetime import datetime
 
+from cliente_profinet import CursorSecuencia, LectorTramas, codificar_comandos, decodificar_trama, decodificar_bloque, es_bloque
+
+# Módulos gráficos: se cargan con cargar_gui() solo cuando se abre la ventana,
+# así el modo headless arranca rápido y sin pantalla.
+tk = ttk = plt = FigureCanvasTkAgg = None
+
+def cargar_gui():
+    global tk, ttk, plt, FigureCanvasTkAgg
+    if tk is None:
+        import tkinter as tk
+        from tkinter import ttk
+        import matplotlib.pyplot as plt
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+
 class AnalizadorProfinet:
-    def __init__(self, root):
+    def __init__(self, root, host="127.0.0.1", port=5000, compresion=None):
+        cargar_gui()
         self.root = root
+        self.host = host
+        self.port = port
+        self.compresion = compresion  # Parámetros de compresión a negociar con la planta (None: sin comprimir)
         self.root.title("Analizador de Red Profinet")
         self.root.geometry("1400x800")
         
@@ -22,6 +36,8 @@ class AnalizadorProfinet:
         self.running = True
         self.connected = False
         self.socket = None
+        self.lector = LectorTramas()
+        self.cursor = CursorSecuencia()  # Último ciclo de la planta incorporado a los históricos
         self.start_time = time.time()
         self.ultima_actualizacion = 0
         
@@ -97,6 +113,8 @@ class AnalizadorProfinet:
         self.connect_btn.pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="Simular Fallo",
                   command=self.simular_fallo).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Exportar",
+                  command=self.exportar_historicos).pack(side=tk.LEFT, padx=5)
         
         # Panel de estado
         estado_frame = ttk.LabelFrame(right_frame, text="Estado", padding="6")
@@ -148,7 +166,8 @@ class AnalizadorProfinet:
             "errores": tk.StringVar(value="0"),
             "ciclo": tk.StringVar(value="0.0 ms"),
             "io": tk.StringVar(value="OK"),
-            "diagnostico": tk.StringVar(value="Sin alarmas")
+            "diagnostico": tk.StringVar(value="Sin alarmas"),
+            "compresion": tk.StringVar(value="No")
         }
         for label, var in [
             ("Tramas:", "tramas"),
@@ -157,7 +176,8 @@ class AnalizadorProfinet:
             ("Errores de Comunicación:", "errores"),
             ("Tiempo de Ciclo:", "ciclo"),
             ("Estado IO:", "io"),
-            ("Diagnóstico:", "diagnostico")
+            ("Diagnóstico:", "diagnostico"),
+            ("Compresión:", "compresion")
         ]:
             frame = ttk.Frame(self.stats_profinet)
             frame.pack(anchor="w")
@@ -427,10 +447,15 @@ class AnalizadorProfinet:
                         pass
                 self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 self.socket.settimeout(1.0)
-                self.socket.connect(("127.0.0.1", 5000))
+                self.socket.connect((self.host, self.port))
+                self.lector.reiniciar()
+                # Pedir a la planta el historial que falta para llenar los gráficos de inmediato
+                saludo = [self.cursor.solicitud(self.max_points)]
+                if self.compresion:
+                    saludo.append({"compresion": self.compresion})
+                self.socket.sendall(codificar_comandos(saludo))
                 self.connected = True
                 self.connect_btn.config(text="Desconectar")
-                self.start_time = time.time()
                 self.estado_indicador.itemconfig('estado', fill='green')
                 self.stats_vars["estado"].set("Conectado")
                 self.log("Conectado a la planta")
@@ -465,25 +490,29 @@ class AnalizadorProfinet:
             except:
                 self.disconnect()
                 
+    def exportar_historicos(self):
+        """Exporta los históricos a CSV/NPZ/Parquet en segundo plano, sin detener la adquisición"""
+        from tkinter import filedialog
+        from exportador import bloques_historial, exportar_en_segundo_plano
+        ruta = filedialog.asksaveasfilename(
+            title="Exportar históricos", defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("NumPy comprimido", "*.npz"), ("Parquet", "*.parquet")])
+        if not ruta:
+            return
+        # Copia instantánea: el hilo de red puede seguir agregando datos mientras se exporta
+        copia = {k: list(v) for k, v in self.datos_historicos.items()}
+        
+        def al_terminar(filas, error):
+            mensaje = f"Error al exportar: {error}" if error else f"Exportadas {filas} filas a {ruta}"
+            self.root.after(0, self.log, mensaje)
+            
+        exportar_en_segundo_plano(bloques_historial(copia), ruta, al_terminar=al_terminar)
+        self.log(f"Exportando históricos a {ruta}...")
+        
     def analizar_trama(self, data):
         try:
-            # Decodificar trama Profinet simulada
-            if len(data) < 8:  # Verificar longitud mínima
-                raise ValueError("Trama demasiado corta")
-            # Extraer cabecera (6 bytes MAC + 2 bytes longitud)
-            header = data[:6]
-            length_bytes = data[6:8]
-            payload = data[8:]
-            longitud = int.from_bytes(length_bytes, byteorder='big')
-            if len(payload) != longitud:
-                raise ValueError(f"Longitud de payload incorrecta: esperada {longitud}, recibida {len(payload)}")
-            try:
-                datos = json.loads(payload.decode())
-                return datos
-            except json.JSONDecodeError:
-                self.log("Error al decodificar JSON del payload")
-                self.errores_detectados += 1
-                return None
+            # Decodificar trama Profinet simulada (cabecera 6 bytes MAC + 2 bytes longitud + JSON)
+            return decodificar_trama(data)
         except Exception as e:
             self.log(f"Error al analizar trama: {e}")
             self.errores_detectados += 1
@@ -513,7 +542,7 @@ class AnalizadorProfinet:
                     self.socket.settimeout(0.1)
                     
                     t_inicio = time.time()
-                    data = self.socket.recv(1024)
+                    data = self.socket.recv(65536)
                     t_fin = time.time()
                     
                     if not data:
@@ -532,73 +561,10 @@ class AnalizadorProfinet:
                         if len(self.profinet_jitters) > 100:
                             self.profinet_jitters.pop(0)
                     
-                    # Procesar datos recibidos
-                    datos = self.analizar_trama(data)
-                    if datos:
-                        self.log(f"Datos recibidos: {datos}")
-                        # Chequeo de cada variable esperada
-                        todos_validos = True
-                        for var in ["temp_reactor", "presion_reactor", "nivel_tanque", "flujo_entrada", "ph_reactor", "conductividad"]:
-                            if var not in datos:
-                                self.log(f"FALTA variable en datos: {var}")
-                                todos_validos = False
-                            else:
-                                valor = datos[var]["valor"]
-                                self.log(f"{var}: {valor}")
-                                if valor is None:
-                                    self.log(f"VALOR NULO para {var}")
-                                    todos_validos = False
-                        if todos_validos:
-                            # Solo si todos los valores son válidos, agregamos a históricos
-                            current_time = time.time() - self.start_time
-                            self.datos_historicos["tiempo"].append(current_time)
-                            for var in ["temp_reactor", "presion_reactor", "nivel_tanque", "flujo_entrada", "ph_reactor", "conductividad"]:
-                                valor = datos[var]["valor"]
-                                self.datos_historicos[var].append(valor)
-                                # Actualizar etiqueta correspondiente
-                                label_map = {
-                                    "temp_reactor": "Temperatura",
-                                    "presion_reactor": "Presión",
-                                    "nivel_tanque": "Nivel",
-                                    "flujo_entrada": "Flujo",
-                                    "ph_reactor": "pH",
-                                    "conductividad": "Conductividad"
-                                }
-                                if var in label_map and label_map[var] in self.var_labels:
-                                    self.var_labels[label_map[var]].set(
-                                        f"{valor:.1f} {datos[var]['unidad']}")
-                        else:
-                            self.log("No se agregó a históricos por datos faltantes o nulos.")
-                            
-                        # Mantener solo los últimos max_points
-                        if len(self.datos_historicos["tiempo"]) > self.max_points:
-                            for key in self.datos_historicos:
-                                self.datos_historicos[key] = self.datos_historicos[key][-self.max_points:]
+                    # Procesar cada trama completa recibida (un recv puede traer varias o una parcial)
+                    for trama in self.lector.alimentar(data):
+                        self.procesar_trama(trama, latencia)
                         
-                        # Actualizar métricas Profinet
-                        self.profinet_tramas += 1
-                        self.profinet_vars["tramas"].set(str(self.profinet_tramas))
-                        if self.profinet_latencias:
-                            self.profinet_vars["latencia"].set(f"{sum(self.profinet_latencias)/len(self.profinet_latencias):.1f} ms")
-                        if self.profinet_jitters:
-                            self.profinet_vars["jitter"].set(f"{sum(self.profinet_jitters)/len(self.profinet_jitters):.1f} ms")
-                        self.profinet_vars["errores"].set(str(self.profinet_errores))
-                        self.profinet_ciclo = latencia
-                        self.profinet_vars["ciclo"].set(f"{self.profinet_ciclo:.1f} ms")
-                        
-                        # Actualizar gráficos y estadísticas
-                        try:
-                            self.root.after_idle(self.actualizar_graficos)
-                            self.root.after_idle(self.actualizar_estadisticas)
-                        except Exception as e:
-                            self.log(f"Error al actualizar interfaz: {e}")
-                        
-                        # Actualizar bytes transferidos
-                        self.bytes_transferidos += len(data)
-                        self.paquetes_recibidos += 1
-                        self.stats_vars["paquetes"].set(str(self.paquetes_recibidos))
-                        self.stats_vars["bytes"].set(f"{self.bytes_transferidos} B")
-                            
                 except socket.timeout:
                     # Timeout es normal, continuamos
                     continue
@@ -609,6 +575,111 @@ class AnalizadorProfinet:
                         break
             time.sleep(0.01)  # Reducir el tiempo de espera para actualizaciones más frecuentes
             
+    def procesar_trama(self, trama, latencia):
+        if es_bloque(trama):
+            self.cargar_bloque(trama)
+            return
+        datos = self.analizar_trama(trama)
+        if datos and "control" in datos:
+            if "error" in datos["control"]:
+                self.log(f"La planta rechazó un comando: {datos['control']['error']}")
+            return
+        if datos and not self.cursor.aceptar(datos):
+            return  # Ciclo ya incorporado desde el bloque de historial
+        if datos:
+            self.log(f"Datos recibidos: {datos}")
+            # Chequeo de cada variable esperada
+            todos_validos = True
+            for var in ["temp_reactor", "presion_reactor", "nivel_tanque", "flujo_entrada", "ph_reactor", "conductividad"]:
+                if var not in datos:
+                    self.log(f"FALTA variable en datos: {var}")
+                    todos_validos = False
+                else:
+                    valor = datos[var]["valor"]
+                    self.log(f"{var}: {valor}")
+                    if valor is None:
+                        self.log(f"VALOR NULO para {var}")
+                        todos_validos = False
+            if todos_validos:
+                # Solo si todos los valores son válidos, agregamos a históricos
+                current_time = datos.get("t", time.time()) - self.start_time
+                self.datos_historicos["tiempo"].append(current_time)
+                for var in ["temp_reactor", "presion_reactor", "nivel_tanque", "flujo_entrada", "ph_reactor", "conductividad"]:
+                    valor = datos[var]["valor"]
+                    self.datos_historicos[var].append(valor)
+                    # Actualizar etiqueta correspondiente
+                    label_map = {
+                        "temp_reactor": "Temperatura",
+                        "presion_reactor": "Presión",
+                        "nivel_tanque": "Nivel",
+                        "flujo_entrada": "Flujo",
+                        "ph_reactor": "pH",
+                        "conductividad": "Conductividad"
+                    }
+                    if var in label_map and label_map[var] in self.var_labels:
+                        self.var_labels[label_map[var]].set(
+                            f"{valor:.1f} {datos[var]['unidad']}")
+            else:
+                self.log("No se agregó a históricos por datos faltantes o nulos.")
+                
+            # Mantener solo los últimos max_points
+            if len(self.datos_historicos["tiempo"]) > self.max_points:
+                for key in self.datos_historicos:
+                    self.datos_historicos[key] = self.datos_historicos[key][-self.max_points:]
+            
+            # Actualizar métricas Profinet
+            self.profinet_tramas += 1
+            self.profinet_vars["tramas"].set(str(self.profinet_tramas))
+            if self.profinet_latencias:
+                self.profinet_vars["latencia"].set(f"{sum(self.profinet_latencias)/len(self.profinet_latencias):.1f} ms")
+            if self.profinet_jitters:
+                self.profinet_vars["jitter"].set(f"{sum(self.profinet_jitters)/len(self.profinet_jitters):.1f} ms")
+            self.profinet_vars["errores"].set(str(self.profinet_errores))
+            self.profinet_ciclo = latencia
+            self.profinet_vars["ciclo"].set(f"{self.profinet_ciclo:.1f} ms")
+            compresion = self.lector.estadisticas_compresion()
+            if compresion:
+                self.profinet_vars["compresion"].set(f"{compresion['ratio']:.1f}x, {compresion['cpu_us_trama']:.0f} µs/trama")
+            
+            # Actualizar gráficos y estadísticas
+            try:
+                self.root.after_idle(self.actualizar_graficos)
+                self.root.after_idle(self.actualizar_estadisticas)
+            except Exception as e:
+                self.log(f"Error al actualizar interfaz: {e}")
+            
+            # Actualizar bytes transferidos
+            self.bytes_transferidos += len(trama)
+            self.paquetes_recibidos += 1
+            self.stats_vars["paquetes"].set(str(self.paquetes_recibidos))
+            self.stats_vars["bytes"].set(f"{self.bytes_transferidos} B")
+            
+    def cargar_bloque(self, trama):
+        """Incorpora de una vez el bloque de historial enviado por la planta al conectar"""
+        try:
+            bloque = decodificar_bloque(trama)
+        except ValueError as e:
+            self.log(f"Error al analizar bloque de historial: {e}")
+            self.errores_detectados += 1
+            return
+        columnas = self.cursor.filas_nuevas(bloque)
+        if not columnas["seq"]:
+            return
+            
+        self.datos_historicos["tiempo"].extend(t - self.start_time for t in columnas["tiempo"])
+        for var in ["temp_reactor", "presion_reactor", "nivel_tanque", "flujo_entrada", "ph_reactor", "conductividad"]:
+            self.datos_historicos[var].extend(columnas[var])
+        if len(self.datos_historicos["tiempo"]) > self.max_points:
+            for key in self.datos_historicos:
+                self.datos_historicos[key] = self.datos_historicos[key][-self.max_points:]
+        
+        self.bytes_transferidos += len(trama)
+        self.log(f"Historial recibido: {len(columnas['seq'])} ciclos ({len(trama)} B)")
+        try:
+            self.root.after_idle(self.actualizar_graficos)
+        except Exception as e:
+            self.log(f"Error al actualizar interfaz: {e}")
+            
     def on_closing(self):
         self.running = False
         if self.connected:
@@ -616,8 +687,50 @@ class AnalizadorProfinet:
         self.root.destroy()
 
 def main():
+    parser = argparse.ArgumentParser(description="Analizador de red Profinet")
+    parser.add_argument("--host", default="127.0.0.1", help="Dirección de la planta")
+    parser.add_argument("--port", type=int, default=5000, help="Puerto de la planta")
+    parser.add_argument("--headless", action="store_true",
+                        help="Sin interfaz gráfica: volcar valores y métricas a stdout o a --salida")
+    parser.add_argument("--formato", choices=["ndjson", "csv"], default="ndjson", help="Formato del modo headless")
+    parser.add_argument("--salida", help="Archivo de salida del modo headless (por defecto stdout)")
+    parser.add_argument("--duracion", type=float, help="Segundos de captura en modo headless")
+    parser.add_argument("--tramas", type=int, help="Número de tramas a capturar en modo headless")
+    parser.add_argument("--historial", type=int, default=0,
+                        help="Ciclos del historial de la planta a volcar antes del directo en modo headless")
+    parser.add_argument("--compresion", type=int, metavar="NIVEL",
+                        help="Negociar compresión zlib del flujo con la planta (nivel 0-9)")
+    parser.add_argument("--vaciado", choices=["trama", "lote"], default="lote",
+                        help="Vaciar el compresor por trama o por lote de tramas agrupadas")
+    parser.add_argument("--senales", help="Señales a suscribir en modo headless, separadas por comas (nombre o id)")
+    parser.add_argument("--periodo", type=float, help="Periodo (s) de las tramas suscritas en modo headless")
+    parser.add_argument("--agregacion", choices=["last", "mean", "minmax"], default="last",
+                        help="Agregación de cada periodo suscrito")
+    args = parser.parse_args()
+    
+    compresion = None
+    if args.compresion is not None:
+        compresion = {"nivel": args.compresion, "vaciado": args.vaciado}
+        
+    if args.headless:
+        from cliente_profinet import ejecutar_headless
+        suscripcion = None
+        if args.senales or args.periodo:
+            suscripcion = {"agregacion": args.agregacion}
+            if args.senales:
+                suscripcion["senales"] = args.senales.split(",")
+            if args.periodo:
+                suscripcion["periodo"] = args.periodo
+        try:
+            ejecutar_headless(args.host, args.port, args.formato, args.salida, args.duracion, args.tramas,
+                              args.historial, suscripcion, compresion)
+        except KeyboardInterrupt:
+            pass
+        return
+        
+    cargar_gui()
     root = tk.Tk()
-    app = AnalizadorProfinet(root)
+    app = AnalizadorProfinet(root, args.host, args.port, compresion)
     root.protocol("WM_DELETE_WINDOW", app.on_closing)
     root.mainloop()
 
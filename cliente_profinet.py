@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""Núcleo del analizador Profinet sin dependencias gráficas.
+
+Contiene el entramado de la conexión TCP (la planta envía tramas de longitud
+variable que pueden llegar partidas o agrupadas en un mismo recv), el cálculo de
+métricas de red y el modo headless que vuelca valores y métricas a NDJSON/CSV.
+Solo usa la biblioteca estándar para arrancar rápido y funcionar sin pantalla.
+"""
+import csv
+import json
+import socket
+import struct
+import sys
+import time
+import zlib
+from array import array
+from bisect import bisect_right
+from collections import deque
+
+# Orden canónico de las variables de proceso
+SENSORES = ["temp_reactor", "presion_reactor", "nivel_tanque", "flujo_entrada", "ph_reactor", "conductividad"]
+
+LONGITUD_CABECERA = 8  # 6 bytes MAC/EtherType + 2 bytes de longitud
+LONGITUD_CABECERA_BLOQUE = 10  # 6 bytes MAC/EtherType + 4 bytes de longitud
+ETHERTYPE_BLOQUE = b"\x88\x93"  # Bloque de historial comprimido enviado por la planta al conectar
+
+
+def es_bloque(trama):
+    return trama[4:6] == ETHERTYPE_BLOQUE
+
+
+def solicitud_historial(desde=0, maximo=None, sesion=None):
+    """Saludo inicial: pide a la planta el historial con seq > desde (maximo=0 para no recibirlo).
+
+    sesion: sesión de la planta a la que pertenece `desde`; si la planta se reinició desde
+    entonces, envía su historial completo."""
+    backfill = {"desde": desde}
+    if maximo is not None:
+        backfill["max"] = maximo
+    if sesion is not None:
+        backfill["sesion"] = sesion
+    return {"backfill": backfill}
+
+
+def codificar_comandos(comandos):
+    """Comandos JSON concatenados en un solo envío: la planta lee el saludo completo antes de
+    registrar al cliente, así la suscripción y la compresión rigen desde la primera trama"""
+    return b"".join(json.dumps(comando).encode() for comando in comandos)
+
+
+def decodificar_bloque(trama):
+    """Decodifica un bloque de historial: devuelve sus metadatos con "columnas" como {nombre: array('d')}"""
+    try:
+        cuerpo = zlib.decompress(trama[LONGITUD_CABECERA_BLOQUE:])
+        longitud_meta = struct.unpack('!I', cuerpo[:4])[0]
+        meta = json.loads(cuerpo[4:4 + longitud_meta].decode())
+    except (zlib.error, struct.error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("Bloque de historial corrupto")
+
+    datos = memoryview(cuerpo)[4 + longitud_meta:]
+    tam_columna = meta["filas"] * 8
+    if len(datos) != tam_columna * len(meta["columnas"]):
+        raise ValueError("Tamaño de bloque de historial incorrecto")
+    columnas = {}
+    for i, nombre in enumerate(meta["columnas"]):
+        columna = array('d')
+        columna.frombytes(datos[i * tam_columna:(i + 1) * tam_columna])
+        if meta.get("orden", sys.byteorder) != sys.byteorder:
+            columna.byteswap()
+        columnas[nombre] = columna
+    meta["columnas"] = columnas
+    return meta
+
+
+def filtrar_bloque(columnas, ultimo_seq):
+    """Descarta las filas ya recibidas (seq <= ultimo_seq); el bloque viene ordenado por seq"""
+    inicio = bisect_right(columnas["seq"], ultimo_seq)
+    return {nombre: columna[inicio:] for nombre, columna in columnas.items()}
+
+
+def decodificar_trama(trama):
+    """Decodifica una trama completa y devuelve el dict del payload; lanza ValueError si es inválida"""
+    if len(trama) < LONGITUD_CABECERA:
+        raise ValueError("Trama demasiado corta")
+    longitud = int.from_bytes(trama[6:8], byteorder='big')
+    payload = trama[LONGITUD_CABECERA:]
+    if len(payload) != longitud:
+        raise ValueError(f"Longitud de payload incorrecta: esperada {longitud}, recibida {len(payload)}")
+    try:
+        return json.loads(payload.decode())
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("Error al decodificar JSON del payload")
+
+
+class CursorSecuencia:
+    """Último ciclo de la planta recibido: descarta duplicados entre el bloque de historial y el directo.
+
+    La planta numera los ciclos desde 1 en cada arranque y marca tramas y bloques con su sesión;
+    si la sesión cambia, la secuencia volvió a empezar y el cursor se reinicia.
+    """
+    def __init__(self):
+        self.sesion = None
+        self.ultimo_seq = 0
+        self.reinicios_planta = 0
+
+    def _comprobar_sesion(self, sesion):
+        if sesion is None or sesion == self.sesion:
+            return
+        if self.sesion is not None:
+            self.reinicios_planta += 1
+        self.sesion = sesion
+        self.ultimo_seq = 0
+
+    def aceptar(self, mensaje):
+        """True si la trama es nueva (y avanza el cursor); False si ya llegó en el historial"""
+        self._comprobar_sesion(mensaje.get("sesion"))
+        seq = mensaje.get("seq")
+        if seq is None:
+            return True
+        if seq <= self.ultimo_seq:
+            return False
+        self.ultimo_seq = seq
+        return True
+
+    def filas_nuevas(self, bloque):
+        """Columnas de un bloque decodificado sin las filas ya recibidas (y avanza el cursor)"""
+        self._comprobar_sesion(bloque.get("sesion"))
+        columnas = filtrar_bloque(bloque["columnas"], self.ultimo_seq)
+        if columnas["seq"]:
+            self.ultimo_seq = int(columnas["seq"][-1])
+        return columnas
+
+    def solicitud(self, maximo=None):
+        return solicitud_historial(self.ultimo_seq, maximo, self.sesion)
+
+
+class LectorTramas:
+    """Reensambla tramas completas a partir de los fragmentos leídos del socket.
+
+    Si la planta confirma compresión (trama de control {"control": {"compresion": ...}}), todo lo
+    que llega después es un flujo zlib que se descomprime aquí de forma incremental. Las demás
+    tramas de control (p. ej. {"control": {"error": ...}}) se devuelven como cualquier trama.
+    """
+    def __init__(self):
+        self.buffer = bytearray()
+        self.reiniciar()
+
+    def alimentar(self, data):
+        """Añade bytes recibidos y devuelve la lista de tramas completas disponibles"""
+        self.buffer += self._descomprimir(data)
+        tramas = []
+        inicio = 0
+        while len(self.buffer) - inicio >= LONGITUD_CABECERA:
+            if self.buffer[inicio + 4:inicio + 6] == ETHERTYPE_BLOQUE:
+                if len(self.buffer) - inicio < LONGITUD_CABECERA_BLOQUE:
+                    break
+                longitud = int.from_bytes(self.buffer[inicio + 6:inicio + 10], byteorder='big')
+                fin = inicio + LONGITUD_CABECERA_BLOQUE + longitud
+            else:
+                longitud = int.from_bytes(self.buffer[inicio + 6:inicio + 8], byteorder='big')
+                fin = inicio + LONGITUD_CABECERA + longitud
+            if fin > len(self.buffer):
+                break
+            trama = bytes(self.buffer[inicio:fin])
+            inicio = fin
+            if trama.startswith(b'{"control": {"compresion"', LONGITUD_CABECERA):
+                # Lo que queda tras la confirmación ya viene comprimido
+                self._activar_descompresion(decodificar_trama(trama)["control"])
+                resto = bytes(self.buffer[inicio:])
+                self.buffer.clear()
+                inicio = 0
+                self.buffer += self._descomprimir(resto)
+                continue
+            if self.descompresor:
+                self.tramas_comprimidas += 1
+            tramas.append(trama)
+        del self.buffer[:inicio]
+        return tramas
+
+    def _activar_descompresion(self, control):
+        diccionario = control["compresion"]["diccionario"].encode("latin-1")
+        self.descompresor = zlib.decompressobj(zdict=diccionario)
+        self.nivel_compresion = control["compresion"]["nivel"]
+
+    def _descomprimir(self, data):
+        if not self.descompresor or not data:
+            return data
+        t_inicio = time.thread_time()
+        salida = self.descompresor.decompress(data)
+        self.cpu_descompresion += time.thread_time() - t_inicio
+        self.bytes_comprimidos += len(data)
+        self.bytes_descomprimidos += len(salida)
+        return salida
+
+    def estadisticas_compresion(self):
+        """Relación de compresión y coste de CPU por trama; None si la conexión no va comprimida"""
+        if not self.descompresor:
+            return None
+        return {
+            "nivel": self.nivel_compresion,
+            "ratio": self.bytes_descomprimidos / self.bytes_comprimidos if self.bytes_comprimidos else 0.0,
+            "cpu_us_trama": self.cpu_descompresion / self.tramas_comprimidas * 1e6 if self.tramas_comprimidas else 0.0,
+        }
+
+    def reiniciar(self):
+        self.buffer.clear()
+        self.descompresor = None
+        self.nivel_compresion = None
+        self.bytes_comprimidos = 0
+        self.bytes_descomprimidos = 0
+        self.cpu_descompresion = 0.0
+        self.tramas_comprimidas = 0
+
+
+class MetricasRed:
+    """Latencia, jitter y tiempo de ciclo sobre una ventana deslizante de tramas"""
+    def __init__(self, ventana=100):
+        self.tramas = 0
+        self.errores = 0
+        self.bytes = 0
+        self.latencias = deque(maxlen=ventana)
+        self.jitters = deque(maxlen=ventana)
+        self.ciclo = 0.0
+        self.ultima_llegada = None
+
+    def registrar_lectura(self, latencia, nbytes):
+        """Registra un recv: latencia en ms (tiempo de espera del recv) y bytes leídos"""
+        self.latencias.append(latencia)
+        if len(self.latencias) > 1:
+            self.jitters.append(abs(self.latencias[-1] - self.latencias[-2]))
+        self.bytes += nbytes
+
+    def registrar_trama(self, llegada):
+        if self.ultima_llegada is not None:
+            self.ciclo = (llegada - self.ultima_llegada) * 1000
+        self.ultima_llegada = llegada
+        self.tramas += 1
+
+    def resumen(self):
+        return {
+            "tramas": self.tramas,
+            "errores": self.errores,
+            "bytes": self.bytes,
+            "latencia_ms": sum(self.latencias) / len(self.latencias) if self.latencias else 0.0,
+            "jitter_ms": sum(self.jitters) / len(self.jitters) if self.jitters else 0.0,
+            "ciclo_ms": self.ciclo,
+        }
+
+
+class ClienteProfinet:
+    """Conexión a la planta: recibe tramas, las decodifica y mantiene las métricas de red"""
+    def __init__(self, host="127.0.0.1", port=5000):
+        self.host = host
+        self.port = port
+        self.socket = None
+        self.lector = LectorTramas()
+        self.metricas = MetricasRed()
+        self.cursor = CursorSecuencia()  # Evita duplicados entre historial y directo
+        self.errores_planta = []  # Comandos rechazados por la planta, pendientes de informar
+
+    def conectar(self, timeout=1.0, historial=None, suscripcion=None, compresion=None):
+        """Conecta y pide el historial posterior al último seq recibido (historial=0 para omitirlo).
+
+        suscripcion: {"senales": [...], "periodo": s, "agregacion": "last"|"mean"|"minmax"} para
+        recibir solo algunas señales a menor ritmo; None recibe todo en cada ciclo.
+        compresion: {"nivel": 0-9, "vaciado": "trama"|"lote"} para negociar un flujo zlib."""
+        self.socket = socket.create_connection((self.host, self.port), timeout=timeout)
+        self.lector.reiniciar()
+        saludo = [self.cursor.solicitud(historial)]
+        if suscripcion:
+            saludo.append({"suscribir": suscripcion})
+        if compresion:
+            saludo.append({"compresion": compresion})
+        self.socket.sendall(codificar_comandos(saludo))
+
+    def desconectar(self):
+        if self.socket:
+            try:
+                self.socket.close()
+            except OSError:
+                pass
+        self.socket = None
+
+    def enviar_comando(self, comando):
+        self.socket.sendall(json.dumps(comando).encode())
+
+    def recibir(self, timeout=0.1):
+        """Lee del socket y devuelve la lista de payloads decodificados (vacía si no llegó nada)"""
+        self.socket.settimeout(timeout)
+        t_inicio = time.time()
+        try:
+            data = self.socket.recv(65536)
+        except socket.timeout:
+            return []
+        t_fin = time.time()
+        if not data:
+            raise ConnectionError("Conexión cerrada por el servidor")
+
+        self.metricas.registrar_lectura((t_fin - t_inicio) * 1000, len(data))
+        datos = []
+        try:
+            tramas = self.lector.alimentar(data)
+        except (zlib.error, ValueError) as e:
+            raise ConnectionError(f"Flujo comprimido corrupto: {e}")
+        for trama in tramas:
+            try:
+                if es_bloque(trama):
+                    datos.extend(self.filas_bloque(decodificar_bloque(trama)))
+                    continue
+                mensaje = decodificar_trama(trama)
+            except ValueError:
+                self.metricas.errores += 1
+                continue
+            if "control" in mensaje:
+                if "error" in mensaje["control"]:
+                    self.errores_planta.append(mensaje["control"]["error"])
+                continue
+            self.metricas.registrar_trama(t_fin)
+            if self.cursor.aceptar(mensaje):
+                datos.append(mensaje)
+        return datos
+
+    def filas_bloque(self, bloque):
+        """Convierte las filas nuevas de un bloque de historial en mensajes con la forma de las tramas"""
+        columnas = self.cursor.filas_nuevas(bloque)
+        nombres = [n for n in columnas if n not in ("seq", "tiempo")]
+        filas = []
+        for i in range(len(columnas["seq"])):
+            mensaje = {"seq": int(columnas["seq"][i]), "t": columnas["tiempo"][i]}
+            for nombre in nombres:
+                valor = columnas[nombre][i]
+                mensaje[nombre] = {"valor": None if valor != valor else valor, "unidad": bloque["unidades"].get(nombre)}
+            filas.append(mensaje)
+        return filas
+
+
+def resumen_metricas(cliente):
+    metricas = cliente.metricas.resumen()
+    compresion = cliente.lector.estadisticas_compresion()
+    if compresion:
+        metricas["ratio_compresion"] = round(compresion["ratio"], 2)
+        metricas["cpu_descompresion_us"] = round(compresion["cpu_us_trama"], 1)
+    return metricas
+
+
+def fila_salida(datos, t_relativo, metricas):
+    """Aplana valores de proceso y métricas en una fila para NDJSON/CSV"""
+    fila = {"tiempo": round(t_relativo, 4), "seq": datos.get("seq")}
+    for var in SENSORES:
+        lectura = datos.get(var)
+        fila[var] = lectura.get("valor") if isinstance(lectura, dict) else None
+        if isinstance(lectura, dict) and "min" in lectura:
+            fila[f"{var}_min"] = lectura["min"]
+            fila[f"{var}_max"] = lectura["max"]
+    fila.update(metricas)
+    return fila
+
+
+def columnas_salida(suscripcion=None, compresion=None):
+    """Columnas del CSV headless, fijadas de antemano: las primeras filas (historial, o anteriores
+    a la confirmación de compresión) no traen todas las columnas"""
+    columnas = ["tiempo", "seq"]
+    minmax = bool(suscripcion) and suscripcion.get("agregacion") == "minmax"
+    for var in SENSORES:
+        columnas.append(var)
+        if minmax:
+            columnas += [f"{var}_min", f"{var}_max"]
+    columnas += list(MetricasRed().resumen())
+    if compresion:
+        columnas += ["ratio_compresion", "cpu_descompresion_us"]
+    return columnas
+
+
+def ejecutar_headless(host="127.0.0.1", port=5000, formato="ndjson", salida=None, duracion=None, max_tramas=None,
+                      historial=0, suscripcion=None, compresion=None):
+    """Conecta a la planta y vuelca cada trama decodificada con sus métricas a stdout o a un archivo.
+
+    historial: filas del historial de la planta a volcar antes del directo (None = todas).
+    suscripcion: señales/periodo/agregación a pedir a la planta (ver ClienteProfinet.conectar).
+    compresion: parámetros de compresión del flujo a negociar (ver ClienteProfinet.conectar)."""
+    cliente = ClienteProfinet(host, port)
+    archivo = None
+    writer = None
+    escritas = 0
+    try:
+        cliente.conectar(historial=historial, suscripcion=suscripcion, compresion=compresion)
+        archivo = open(salida, "w", newline="") if salida else sys.stdout
+        if formato == "csv":
+            writer = csv.DictWriter(archivo, fieldnames=columnas_salida(suscripcion, compresion), extrasaction="ignore")
+            writer.writeheader()
+        inicio = time.time()
+        while duracion is None or time.time() - inicio < duracion:
+            datos_recibidos = cliente.recibir()
+            while cliente.errores_planta:
+                print(f"[ANALIZADOR] La planta rechazó un comando: {cliente.errores_planta.pop(0)}", file=sys.stderr)
+            for datos in datos_recibidos:
+                fila = fila_salida(datos, datos.get("t", time.time()) - inicio, resumen_metricas(cliente))
+                if writer:
+                    writer.writerow(fila)
+                else:
+                    archivo.write(json.dumps(fila) + "\n")
+                archivo.flush()
+                escritas += 1
+                if max_tramas is not None and escritas >= max_tramas:
+                    return resumen_metricas(cliente)
+        return resumen_metricas(cliente)
+    except OSError as e:
+        print(f"[ANALIZADOR] {e}", file=sys.stderr)
+        if archivo is None:
+            sys.exit(1)  # No se llegó a conectar o a abrir la salida
+        return resumen_metricas(cliente)
+    finally:
+        cliente.desconectar()
+        if archivo not in (None, sys.stdout):
+            archivo.close()
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""Barrido Monte Carlo de estrategias de control sobre la planta simulada.
+
+Cada escenario corre ProcesoIndustrial.simular_lote (sin red, reloj virtual) con un
+lazo cerrado, una semilla de ruido y fallos inyectados, y devuelve tiempo de
+establecimiento, sobreimpulso y energía (potencia de todos los actuadores encendidos,
+calentador y válvulas, integrada en el tiempo). Los escenarios se reparten entre núcleos
+con ProcessPoolExecutor.
+"""
+import argparse
+import csv
+import itertools
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from planta_industrial import ACTUADOR_POR_VARIABLE, ProcesoIndustrial, ControladorPID, ControladorOnOff
+
+ESCENARIO_BASE = {
+    "variable": "temp_reactor",
+    "controlador": "pid",
+    "kp": 0.5,
+    "ki": 0.05,
+    "kd": 0.0,
+    "histeresis": 1.0,
+    "setpoint": 40.0,
+    "inicial": {"temp_reactor": 25.0},
+    "actuadores": {},  # Estado fijo de actuadores no controlados
+    "fallos": [],      # Lista de [tiempo, sensor, duracion]
+    "semilla": 0,
+    "duracion": 600.0,
+    "dt": 0.1,
+    "banda": 0.05,     # Banda de establecimiento relativa al setpoint
+}
+
+
+def crear_controlador(escenario):
+    if escenario["controlador"] == "onoff":
+        return ControladorOnOff(escenario["histeresis"])
+    return ControladorPID(escenario["kp"], escenario["ki"], escenario["kd"])
+
+
+def ejecutar_escenario(escenario):
+    """Corre un escenario completo; función de módulo para poder enviarse a otros procesos"""
+    escenario = {**ESCENARIO_BASE, **escenario}
+    variable = escenario["variable"]
+    actuador = ACTUADOR_POR_VARIABLE[variable]
+
+    proceso = ProcesoIndustrial("Escenario", semilla=escenario["semilla"])
+    for sensor, valor in escenario["inicial"].items():
+        proceso.sensores[sensor].valor = valor
+    proceso.actuadores.update(escenario["actuadores"])
+    proceso.setpoints[variable] = escenario["setpoint"]
+    proceso.configurar_control(variable, actuador, crear_controlador(escenario))
+
+    programa = []
+    for t, sensor, duracion in escenario["fallos"]:
+        programa.append((t, {"simular_fallo": True, "sensor": sensor}))
+        programa.append((t + duracion, {"reparar": True, "sensor": sensor}))
+
+    columnas = proceso.simular_lote(escenario["duracion"], dt=escenario["dt"], programa=programa)
+    metricas = calcular_metricas(columnas["tiempo"], columnas[variable], escenario["setpoint"],
+                                 escenario["banda"])
+    metricas["energia"] = proceso.energia_consumida
+    metricas["ciclo_trabajo"] = sum(columnas[actuador]) / max(len(columnas[actuador]), 1)
+    return {**{k: escenario[k] for k in ("id", "controlador", "kp", "ki", "kd", "histeresis", "semilla")
+               if k in escenario},
+            "fallos": len(escenario["fallos"]), **metricas}
+
+
+def calcular_metricas(tiempo, medida, setpoint, banda):
+    """Tiempo de establecimiento (entrada definitiva en la banda), sobreimpulso (%) y error final"""
+    validos = [(t, y) for t, y in zip(tiempo, medida) if not math.isnan(y)]
+    if not validos:
+        return {"establecimiento": math.inf, "sobreimpulso": 0.0, "error_final": math.inf}
+
+    y0 = validos[0][1]
+    tolerancia = abs(setpoint) * banda
+    establecimiento = validos[0][0] - tiempo[0]
+    for t, y in validos:
+        if abs(y - setpoint) > tolerancia:
+            establecimiento = t - tiempo[0]
+    if abs(validos[-1][1] - setpoint) > tolerancia:
+        establecimiento = math.inf
+
+    salto = setpoint - y0
+    if salto > 0:
+        pico = max(y for _, y in validos) - setpoint
+    else:
+        pico = setpoint - min(y for _, y in validos)
+    sobreimpulso = max(0.0, pico) / abs(salto) * 100 if salto else 0.0
+
+    cola = [y for _, y in validos[-max(1, len(validos) // 10):]]
+    return {
+        "establecimiento": establecimiento,
+        "sobreimpulso": sobreimpulso,
+        "error_final": sum(cola) / len(cola) - setpoint,
+    }
+
+
+def generar_barrido(kps, kis, kds, semillas, fallos=((),), histeresis=(1.0,), **fijos):
+    """Producto cartesiano de ganancias, histéresis, semillas y conjuntos de fallos"""
+    escenarios = []
+    combinaciones = itertools.product(kps, kis, kds, histeresis, semillas, fallos)
+    for i, (kp, ki, kd, h, semilla, fallo) in enumerate(combinaciones):
+        escenarios.append({**fijos, "id": i, "kp": kp, "ki": ki, "kd": kd, "histeresis": h,
+                           "semilla": semilla, "fallos": list(fallo)})
+    return escenarios
+
+
+def ejecutar_barrido(escenarios, procesos=None):
+    """Reparte los escenarios entre núcleos; los lotes agrupan escenarios para amortizar el IPC"""
+    procesos = procesos or os.cpu_count() or 1
+    lote = max(1, len(escenarios) // (procesos * 4))
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        return list(pool.map(ejecutar_escenario, escenarios, chunksize=lote))
+
+
+def resumir(resultados):
+    """Agrega por combinación de ganancias (promedio sobre semillas y fallos) y ordena por desempeño"""
+    grupos = {}
+    for r in resultados:
+        grupos.setdefault((r["controlador"], r["kp"], r["ki"], r["kd"], r["histeresis"]), []).append(r)
+
+    resumen = []
+    for (controlador, kp, ki, kd, h), grupo in grupos.items():
+        tiempos = [r["establecimiento"] for r in grupo]
+        establecidos = [t for t in tiempos if math.isfinite(t)]
+        resumen.append({
+            "controlador": controlador, "kp": kp, "ki": ki, "kd": kd, "histeresis": h,
+            "escenarios": len(grupo),
+            "tasa_establecimiento": len(establecidos) / len(grupo),
+            "establecimiento_medio": sum(establecidos) / len(establecidos) if establecidos else math.inf,
+            "sobreimpulso_medio": sum(r["sobreimpulso"] for r in grupo) / len(grupo),
+            "energia_media": sum(r["energia"] for r in grupo) / len(grupo),
+        })
+    resumen.sort(key=lambda r: (-r["tasa_establecimiento"], r["establecimiento_medio"], r["energia_media"]))
+    return resumen
+
+
+def lista_floats(texto):
+    return [float(x) for x in texto.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Barrido Monte Carlo de lazos de control de la planta")
+    parser.add_argument("--variable", choices=sorted(ACTUADOR_POR_VARIABLE), default="temp_reactor")
+    parser.add_argument("--controlador", choices=["pid", "onoff"], default="pid")
+    parser.add_argument("--kp", type=lista_floats, default=[0.1, 0.5, 1.0])
+    parser.add_argument("--ki", type=lista_floats, default=[0.0, 0.02, 0.05])
+    parser.add_argument("--kd", type=lista_floats, default=[0.0])
+    parser.add_argument("--histeresis", type=lista_floats, default=[0.5, 1.0, 2.0],
+                        help="Histéresis a barrer con el controlador onoff")
+    parser.add_argument("--setpoint", type=float, default=ESCENARIO_BASE["setpoint"])
+    parser.add_argument("--semillas", type=int, default=10, help="Número de semillas de ruido por combinación")
+    parser.add_argument("--fallo", action="append", default=[], metavar="T,SENSOR,DURACION",
+                        help="Inyectar un fallo de sensor (se barre con y sin fallos)")
+    parser.add_argument("--duracion", type=float, default=ESCENARIO_BASE["duracion"])
+    parser.add_argument("--procesos", type=int, help="Procesos de trabajo (por defecto, todos los núcleos)")
+    parser.add_argument("--salida", help="CSV con el resultado de cada escenario")
+    args = parser.parse_args()
+
+    fallos = [()]
+    if args.fallo:
+        # Validar aquí: un sensor mal escrito abortaría el barrido desde un proceso de trabajo
+        sensores = ProcesoIndustrial("Validación").sensores
+        inyectados = []
+        for f in args.fallo:
+            try:
+                t, sensor, duracion = f.split(",")
+                inyectados.append((float(t), sensor, float(duracion)))
+            except ValueError:
+                parser.error(f"Fallo mal formado: {f} (se espera T,SENSOR,DURACION)")
+            if sensor not in sensores:
+                parser.error(f"Sensor desconocido en --fallo: {sensor} (opciones: {', '.join(sensores)})")
+        fallos.append(tuple(inyectados))
+
+    fijos = {"variable": args.variable, "controlador": args.controlador,
+             "setpoint": args.setpoint, "duracion": args.duracion}
+    if args.variable == "nivel_tanque":
+        fijos["inicial"] = {"nivel_tanque": 50.0}
+        fijos["actuadores"] = {"valvula_salida": True}
+    if args.controlador == "onoff":
+        escenarios = generar_barrido([0.0], [0.0], [0.0], range(args.semillas), fallos,
+                                     histeresis=args.histeresis, **fijos)
+    else:
+        escenarios = generar_barrido(args.kp, args.ki, args.kd, range(args.semillas), fallos, **fijos)
+
+    inicio = time.perf_counter()
+    resultados = ejecutar_barrido(escenarios, args.procesos)
+    duracion = time.perf_counter() - inicio
+    print(f"[ESCENARIOS] {len(resultados)} escenarios en {duracion:.1f} s "
+          f"({len(resultados) / max(duracion, 1e-9):.1f} escenarios/s)")
+
+    if args.salida:
+        with open(args.salida, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(resultados[0]))
+            writer.writeheader()
+            writer.writerows(resultados)
+
+    for fila in resumir(resultados)[:10]:
+        print(json.dumps(fila))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""Exportación por bloques de históricos del analizador a CSV, NPZ o Parquet.
+
+Las fuentes entregan bloques columnares de tamaño acotado ({columna: array('d')}) y los
+escritores los vuelcan a medida que llegan, así que la memoria no depende de la duración
+exportada. Fuentes: los históricos en memoria del analizador o una grabación del modo
+headless (CSV/NDJSON) filtrada por rango de tiempo.
+
+NPZ se escribe sin NumPy (formato .npy v1.0 dentro de un zip). Parquet requiere pyarrow.
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+from array import array
+
+TAM_BLOQUE = 65536  # Filas por bloque
+FORMATOS = ("csv", "npz", "parquet")
+AVISO_PYARROW = "La exportación a Parquet requiere pyarrow (pip install pyarrow)"
+
+NAN = float("nan")
+
+
+def a_float(valor):
+    if valor is None or valor == "":
+        return NAN
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return NAN
+
+
+# --- Fuentes -----------------------------------------------------------------------------
+
+def bloques_historial(datos_historicos, tam_bloque=TAM_BLOQUE):
+    """Bloques a partir de los históricos del analizador ({columna: lista})"""
+    columnas = list(datos_historicos)
+    total = min(len(datos_historicos[c]) for c in columnas) if columnas else 0
+    for inicio in range(0, total, tam_bloque):
+        yield {c: array('d', map(a_float, datos_historicos[c][inicio:inicio + tam_bloque])) for c in columnas}
+
+
+def bloques_archivo(ruta, tam_bloque=TAM_BLOQUE, desde=None, hasta=None):
+    """Bloques a partir de una grabación CSV o NDJSON, opcionalmente limitada a [desde, hasta] en "tiempo" """
+    with open(ruta, newline="") as f:
+        if ruta.endswith(".csv"):
+            lector = csv.reader(f)
+            columnas = next(lector, [])
+            filas = (dict(zip(columnas, fila)) for fila in lector)
+        else:
+            filas = (json.loads(linea) for linea in f if linea.strip())
+            primera = next(filas, None)
+            if primera is None:
+                return
+            columnas = list(primera)
+            filas = _encadenar(primera, filas)
+
+        bloque = {c: array('d') for c in columnas}
+        n = 0
+        for fila in filas:
+            t = a_float(fila.get("tiempo"))
+            if desde is not None and t < desde:
+                continue
+            if hasta is not None and t > hasta:
+                break  # Las grabaciones están ordenadas en el tiempo
+            for c in columnas:
+                bloque[c].append(a_float(fila.get(c)))
+            n += 1
+            if n == tam_bloque:
+                yield bloque
+                bloque = {c: array('d') for c in columnas}
+                n = 0
+        if n:
+            yield bloque
+
+
+def _encadenar(primera, resto):
+    yield primera
+    yield from resto
+
+
+# --- Escritores --------------------------------------------------------------------------
+# El archivo de salida no se toca hasta tener el primer bloque, y cerrar(completo=False)
+# descarta lo escrito: si la fuente falla no queda un archivo vacío o truncado.
+
+class EscritorCSV:
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.archivo = None
+        self.writer = None
+        self.columnas = None
+
+    def escribir(self, bloque):
+        if self.archivo is None:
+            self.archivo = open(self.ruta, "w", newline="")
+            self.writer = csv.writer(self.archivo)
+            self.columnas = list(bloque)
+            self.writer.writerow(self.columnas)
+        self.writer.writerows(zip(*(bloque[c] for c in self.columnas)))
+
+    def cerrar(self, completo=True):
+        if self.archivo is None:
+            if completo:
+                open(self.ruta, "w").close()  # Exportación sin filas: archivo vacío
+            return
+        self.archivo.close()
+        if not completo:
+            os.remove(self.ruta)
+
+
+class EscritorNPZ:
+    """NPZ comprimido con un .npy float64 por columna.
+
+    La longitud final no se conoce hasta el último bloque, así que cada columna se acumula
+    en un archivo temporal y al cerrar se copia por trozos dentro del zip.
+    """
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self.directorio = tempfile.mkdtemp(prefix="exportacion_")
+        self.temporales = {}
+        self.filas = 0
+
+    def escribir(self, bloque):
+        for c, valores in bloque.items():
+            if c not in self.temporales:
+                self.temporales[c] = open(os.path.join(self.directorio, f"{len(self.temporales)}.bin"), "w+b")
+            valores.tofile(self.temporales[c])
+        self.filas += len(next(iter(bloque.values())))
+
+    def cerrar(self, completo=True):
+        descr = "<f8" if sys.byteorder == "little" else ">f8"
+        try:
+            if not completo:
+                return
+            with zipfile.ZipFile(self.ruta, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                for c, temporal in self.temporales.items():
+                    temporal.seek(0)
+                    with zf.open(f"{c}.npy", "w", force_zip64=True) as destino:
+                        destino.write(cabecera_npy(descr, self.filas))
+                        shutil.copyfileobj(temporal, destino, 1 << 20)
+        finally:
+            for temporal in self.temporales.values():
+                temporal.close()
+            shutil.rmtree(self.directorio, ignore_errors=True)
+
+
+def cabecera_npy(descr, filas):
+    """Cabecera del formato .npy v1.0 para un vector de `filas` elementos"""
+    dic = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': ({filas},), }}"
+    relleno = 64 - (10 + len(dic) + 1) % 64
+    dic = dic + " " * relleno + "\n"
+    return b"\x93NUMPY\x01\x00" + len(dic).to_bytes(2, "little") + dic.encode("latin-1")
+
+
+class EscritorParquet:
+    """Parquet con un grupo de filas por bloque (requiere pyarrow)"""
+    def __init__(self, ruta):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError(AVISO_PYARROW)
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.ruta = ruta
+        self.writer = None
+
+    def escribir(self, bloque):
+        tabla = self.pa.table({c: self.pa.array(valores, type=self.pa.float64()) for c, valores in bloque.items()})
+        if self.writer is None:
+            self.writer = self.pq.ParquetWriter(self.ruta, tabla.schema, compression="zstd")
+        self.writer.write_table(tabla)
+
+    def cerrar(self, completo=True):
+        if self.writer is not None:
+            self.writer.close()
+            if not completo:
+                os.remove(self.ruta)
+
+
+ESCRITORES = {"csv": EscritorCSV, "npz": EscritorNPZ, "parquet": EscritorParquet}
+
+
+def formato_de(ruta):
+    extension = os.path.splitext(ruta)[1].lstrip(".").lower()
+    if extension == "pq":
+        extension = "parquet"
+    if extension not in FORMATOS:
+        raise ValueError(f"Formato de exportación desconocido: {ruta}")
+    return extension
+
+
+def comprobar_formato(ruta):
+    """Formato de la ruta, comprobando antes de empezar que su dependencia opcional está instalada"""
+    formato = formato_de(ruta)
+    if formato == "parquet":
+        try:
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError(AVISO_PYARROW)
+    return formato
+
+
+def exportar(bloques, ruta, formato=None, progreso=None):
+    """Vuelca los bloques al archivo; progreso(filas) se llama tras cada bloque. Devuelve las filas escritas"""
+    escritor = ESCRITORES[formato or formato_de(ruta)](ruta)
+    filas = 0
+    try:
+        for bloque in bloques:
+            escritor.escribir(bloque)
+            filas += len(next(iter(bloque.values()), ()))
+            if progreso:
+                progreso(filas)
+    except BaseException:
+        escritor.cerrar(completo=False)
+        raise
+    escritor.cerrar()
+    return filas
+
+
+def exportar_en_segundo_plano(bloques, ruta, formato=None, al_terminar=None):
+    """Exporta en un hilo aparte para no detener la adquisición.
+
+    al_terminar(filas, error) se llama desde ese hilo al acabar (error es None si todo fue bien).
+    """
+    def tarea():
+        try:
+            filas = exportar(bloques, ruta, formato)
+        except Exception as e:
+            if al_terminar:
+                al_terminar(0, e)
+            return
+        if al_terminar:
+            al_terminar(filas, None)
+
+    hilo = threading.Thread(target=tarea, daemon=True)
+    hilo.start()
+    return hilo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exportar una grabación del analizador a CSV, NPZ o Parquet")
+    parser.add_argument("entrada", help="Grabación CSV o NDJSON del modo headless")
+    parser.add_argument("salida", help="Archivo de salida (.csv, .npz o .parquet)")
+    parser.add_argument("--desde", type=float, help="Tiempo inicial (s) del rango a exportar")
+    parser.add_argument("--hasta", type=float, help="Tiempo final (s) del rango a exportar")
+    parser.add_argument("--bloque", type=int, default=TAM_BLOQUE, help="Filas por bloque")
+    args = parser.parse_args()
+
+    if os.path.exists(args.salida) and os.path.exists(args.entrada) and os.path.samefile(args.entrada, args.salida):
+        parser.error("La salida no puede ser el mismo archivo que la entrada")
+    inicio = time.perf_counter()
+    try:
+        filas = exportar(bloques_archivo(args.entrada, args.bloque, args.desde, args.hasta), args.salida)
+    except OSError as e:
+        parser.error(f"{e.strerror}: {e.filename}" if e.filename else str(e))
+    except (RuntimeError, ValueError) as e:
+        parser.error(str(e))
+    duracion = time.perf_counter() - inicio
+    print(f"[EXPORTADOR] {filas} filas exportadas a {args.salida} en {duracion:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
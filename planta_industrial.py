@@ -1,11 +1,22 @@
 #!/usr/bin/env python3
 import socket
+import select
 import threading
 import time
 import random
 import json
 import struct
 import math
+import sys
+import zlib
+from array import array
+from collections import deque
+
+# Actuador que cierra el lazo de cada variable controlable
+ACTUADOR_POR_VARIABLE = {
+    "temp_reactor": "calentador",
+    "nivel_tanque": "valvula_entrada",
+}
 
 class SensorIndustrial:
     def __init__(self, id, tipo, unidad, rango_min, rango_max, ruido=0.1):
@@ -17,13 +28,14 @@ class SensorIndustrial:
         self.ruido = ruido
         self.valor = (rango_max + rango_min) / 2
         self.fallo = False
+        self.rng = random  # Generador de ruido (reemplazable para simulaciones reproducibles)
         
     def leer_valor(self):
         if self.fallo:
             return None
             
         # Simular dinámica del sensor
-        cambio = random.uniform(-self.ruido, self.ruido)
+        cambio = self.rng.uniform(-self.ruido, self.ruido)
         self.valor = max(self.rango_min, min(self.rango_max, self.valor + cambio))
         return round(self.valor, 2)
         
@@ -33,11 +45,321 @@ class SensorIndustrial:
     def reparar(self):
         self.fallo = False
 
+class ControladorPID:
+    """PID discreto con salida acotada [salida_min, salida_max] y anti-windup por saturación"""
+    def __init__(self, kp, ki=0.0, kd=0.0, salida_min=0.0, salida_max=1.0):
+        self.kp = kp
+        self.ki = ki
+        self.kd = kd
+        self.salida_min = salida_min
+        self.salida_max = salida_max
+        self.integral = 0.0
+        self.error_previo = None
+        
+    def calcular(self, setpoint, medida, dt):
+        error = setpoint - medida
+        derivada = 0.0 if self.error_previo is None else (error - self.error_previo) / dt
+        self.error_previo = error
+        
+        integral = self.integral + error * dt
+        salida = self.kp * error + self.ki * integral + self.kd * derivada
+        if self.salida_min < salida < self.salida_max:
+            self.integral = integral  # Solo integrar fuera de saturación
+        return max(self.salida_min, min(self.salida_max, salida))
+        
+    def reiniciar(self):
+        self.integral = 0.0
+        self.error_previo = None
+
+class ControladorOnOff:
+    """Control todo/nada con histéresis alrededor del setpoint"""
+    def __init__(self, histeresis=1.0):
+        self.histeresis = histeresis
+        self.salida = 0.0
+        
+    def calcular(self, setpoint, medida, dt):
+        if medida < setpoint - self.histeresis:
+            self.salida = 1.0
+        elif medida > setpoint + self.histeresis:
+            self.salida = 0.0
+        return self.salida
+        
+    def reiniciar(self):
+        self.salida = 0.0
+
+class LazoControl:
+    """Lazo cerrado variable -> actuador. Los actuadores son todo/nada, así que la salida
+    continua del controlador (0..1) se aplica como ciclo de trabajo mediante modulación sigma-delta."""
+    def __init__(self, variable, actuador, controlador):
+        self.variable = variable
+        self.actuador = actuador
+        self.controlador = controlador
+        self.acumulado = 0.0
+        
+    def actualizar(self, proceso, dt):
+        sensor = proceso.sensores[self.variable]
+        if sensor.fallo:
+            # Falla segura: sin medida válida se desactiva el actuador
+            self.controlador.reiniciar()
+            self.acumulado = 0.0
+            proceso.actuadores[self.actuador] = False
+            return
+            
+        salida = self.controlador.calcular(proceso.setpoints[self.variable], sensor.valor, dt)
+        self.acumulado += salida
+        encendido = self.acumulado >= 1.0
+        if encendido:
+            self.acumulado -= 1.0
+        proceso.actuadores[self.actuador] = encendido
+
+MAX_COMANDO = 64 * 1024  # Bytes máximos de un comando pendiente de completar
+
+def fin_comandos(datos):
+    """Posición tras el último comando JSON completo de datos (objetos y listas equilibrados).
+    
+    Los comandos no llevan longitud, así que uno puede llegar partido entre dos recv: lo que
+    queda después de esta posición es un comando incompleto que espera al resto.
+    """
+    profundidad = 0
+    en_cadena = escape = False
+    fin = 0
+    for i, b in enumerate(datos):
+        if en_cadena:
+            if escape:
+                escape = False
+            elif b == 0x5C:  # \
+                escape = True
+            elif b == 0x22:  # "
+                en_cadena = False
+        elif b == 0x22:
+            en_cadena = True
+        elif b in b"{[":
+            profundidad += 1
+        elif b in b"}]":
+            profundidad -= 1
+            if profundidad <= 0:
+                profundidad = 0
+                fin = i + 1
+        elif profundidad == 0 and b not in b" \t\r\n":
+            fin = i + 1  # Texto suelto fuera de un objeto: se entrega para rechazarlo
+    return fin
+
+class ClientePlanta:
+    """Cliente conectado con cola de transmisión acotada.
+    
+    Políticas cuando el cliente no consume al ritmo del proceso:
+    - descartar_antiguas: se descarta la trama más vieja (semántica de último valor)
+    - descartar_nuevas: se descarta la trama que llega
+    - desconectar: se cierra la conexión si va más de max_retraso_ms atrasado o la cola se llena
+    
+    Las tramas de control y los bloques de historial van en una cola prioritaria aparte, sin
+    límite ni descarte: perder uno dejaría al cliente con un hueco que no puede detectar.
+    """
+    POLITICAS = ("descartar_antiguas", "descartar_nuevas", "desconectar")
+    
+    def __init__(self, socket_cliente, addr, capacidad=50, politica="descartar_antiguas", max_retraso_ms=2000):
+        if politica not in self.POLITICAS:
+            raise ValueError(f"Política de cola desconocida: {politica}")
+        self.socket = socket_cliente
+        self.addr = addr
+        self.suscripcion = None  # None: todas las señales en cada ciclo
+        self.compresor = None  # Contexto zlib persistente si se negoció compresión
+        self.entrada = b""  # Comando recibido a medias, a la espera del resto
+        self.vaciado = "lote"
+        self.capacidad = capacidad
+        self.politica = politica
+        self.max_retraso_ms = max_retraso_ms
+        self.activo = True
+        self.cola = deque()  # (instante de encolado, trama)
+        self.prioritarias = deque()  # Igual que cola, pero fuera de la política de descarte
+        self.condicion = threading.Condition()
+        self.enviando_desde = None  # Instante de encolado del lote en vuelo
+        
+        # Contadores
+        self.encoladas = 0
+        self.enviadas = 0
+        self.descartadas = 0
+        self.bytes_originales = 0
+        self.bytes_enviados = 0
+        self.retraso_max_ms = 0.0
+        
+    def encolar(self, trama):
+        """Llamado desde el ciclo de proceso: nunca bloquea"""
+        with self.condicion:
+            if not self.activo:
+                return
+            ahora = time.monotonic()
+            retraso = self._retraso_ms(ahora)
+            self.retraso_max_ms = max(self.retraso_max_ms, retraso)
+            
+            if self.politica == "desconectar":
+                motivo = None
+                if retraso > self.max_retraso_ms:
+                    motivo = f"retraso de {retraso:.0f} ms > {self.max_retraso_ms:.0f} ms"
+                elif len(self.cola) >= self.capacidad:
+                    motivo = f"cola llena ({self.capacidad} tramas, retraso {retraso:.0f} ms)"
+                if motivo:
+                    print(f"[PLANTA] Cliente {self.addr} desconectado por {motivo}")
+                    self.cerrar()
+                    return
+            if len(self.cola) >= self.capacidad:
+                self.descartadas += 1
+                if self.politica == "descartar_nuevas":
+                    return
+                self.cola.popleft()
+                
+            self.cola.append((ahora, trama))
+            self.encoladas += 1
+            self.condicion.notify()
+            
+    def encolar_prioritaria(self, trama):
+        """Encola una trama de control o de historial: sale antes que el directo y nunca se descarta"""
+        with self.condicion:
+            if not self.activo:
+                return
+            self.prioritarias.append((time.monotonic(), trama))
+            self.encoladas += 1
+            self.condicion.notify()
+            
+    def siguiente_lote(self, timeout):
+        """Saca todas las tramas pendientes, prioritarias primero (o espera hasta timeout si no hay ninguna)"""
+        with self.condicion:
+            if not self.cola and not self.prioritarias and self.activo:
+                self.condicion.wait(timeout)
+            lote = list(self.prioritarias) + list(self.cola)
+            self.prioritarias.clear()
+            self.cola.clear()
+            if lote:
+                self.enviando_desde = min(t for t, _ in lote)
+            return lote
+            
+    def activar_compresion(self, confirmacion, nivel=6, vaciado="lote", diccionario=b""):
+        """Envía la confirmación sin comprimir y comprime todo lo que siga con un contexto persistente.
+        
+        Solo se llama desde el hilo de envío del cliente, así que el cambio queda ordenado en el flujo.
+        vaciado: "trama" (Z_SYNC_FLUSH por trama) o "lote" (uno por lote de tramas agrupadas).
+        """
+        self.socket.sendall(confirmacion)
+        self.compresor = zlib.compressobj(nivel, zdict=diccionario)
+        self.vaciado = vaciado
+        
+    def enviar(self, lote):
+        tramas = [trama for _, trama in lote]
+        if self.compresor is None:
+            data = b"".join(tramas)
+        elif self.vaciado == "trama":
+            data = b"".join(self.compresor.compress(t) + self.compresor.flush(zlib.Z_SYNC_FLUSH) for t in tramas)
+        else:
+            data = self.compresor.compress(b"".join(tramas)) + self.compresor.flush(zlib.Z_SYNC_FLUSH)
+        # sendall completa las escrituras parciales; solo bloquea el hilo de este cliente
+        self.socket.sendall(data)
+        self.bytes_originales += sum(len(t) for t in tramas)
+        self.bytes_enviados += len(data)
+        with self.condicion:
+            self.enviando_desde = None
+            self.enviadas += len(lote)
+            
+    def _retraso_ms(self, ahora):
+        primeras = (self.cola[0][0] if self.cola else None, self.prioritarias[0][0] if self.prioritarias else None)
+        pendientes = [t for t in (self.enviando_desde,) + primeras if t is not None]
+        return (ahora - min(pendientes)) * 1000 if pendientes else 0.0
+        
+    def retraso_ms(self):
+        with self.condicion:
+            return self._retraso_ms(time.monotonic())
+            
+    def cerrar(self):
+        with self.condicion:
+            self.activo = False
+            self.condicion.notify()
+        try:
+            # shutdown desbloquea un sendall en curso en el hilo del cliente
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.socket.close()
+        except OSError:
+            pass
+            
+    def estadisticas(self):
+        return {
+            "cliente": f"{self.addr[0]}:{self.addr[1]}",
+            "encoladas": self.encoladas,
+            "enviadas": self.enviadas,
+            "descartadas": self.descartadas,
+            "en_cola": len(self.cola) + len(self.prioritarias),
+            "retraso_ms": round(self.retraso_ms(), 1),
+            "retraso_max_ms": round(self.retraso_max_ms, 1),
+            "compresion": round(self.bytes_originales / self.bytes_enviados, 2) if self.bytes_enviados else None,
+        }
+
+class Suscripcion:
+    """Forma de suscripción: señales, decimación (ciclos por trama) y agregación del intervalo.
+    
+    Los clientes con la misma forma comparten una única instancia, de modo que el acumulado
+    y la trama se calculan una sola vez por ciclo para todos ellos.
+    """
+    AGREGACIONES = ("last", "mean", "minmax")
+    
+    def __init__(self, senales, decimacion=1, agregacion="last"):
+        if agregacion not in self.AGREGACIONES:
+            raise ValueError(f"Agregación desconocida: {agregacion}")
+        self.senales = tuple(sorted(senales))
+        self.decimacion = max(1, int(decimacion))
+        self.agregacion = agregacion
+        self.clave = (self.senales, self.decimacion, self.agregacion)
+        self.clientes = 0  # Clientes que la usan, incluidos los que aún están en el saludo
+        self.ciclos = 0
+        self.valores = {s: [] for s in self.senales}
+        
+    def acumular(self, datos):
+        """Acumula un ciclo; devuelve el payload a enviar al cerrar el intervalo, o None"""
+        for s in self.senales:
+            if self.agregacion != "last" and datos[s]["valor"] is not None:
+                self.valores[s].append(datos[s]["valor"])
+        self.ciclos += 1
+        if self.ciclos < self.decimacion:
+            return None
+            
+        payload = {"sesion": datos["sesion"], "seq": datos["seq"], "t": datos["t"]}
+        for s in self.senales:
+            lectura = dict(datos[s])
+            valores = self.valores[s]
+            if self.agregacion == "mean" and valores:
+                lectura["valor"] = round(sum(valores) / len(valores), 4)
+            elif self.agregacion == "minmax" and valores:
+                lectura["min"] = min(valores)
+                lectura["max"] = max(valores)
+            payload[s] = lectura
+            valores.clear()
+        self.ciclos = 0
+        return payload
+
 class ProcesoIndustrial:
-    def __init__(self, nombre, port=5000):
+    def __init__(self, nombre, port=5000, semilla=None, capacidad_cola=50,
+                 politica_cola="descartar_antiguas", max_retraso_ms=2000, historial_max=3000):
         self.nombre = nombre
         self.port = port
         self.running = True
+        self.socket = None
+        self.ciclo = 0.1  # Periodo del ciclo de proceso (s)
+        
+        # Clientes conectados y política de su cola de transmisión
+        self.clientes = []
+        self.lock_clientes = threading.Lock()
+        self.capacidad_cola = capacidad_cola
+        self.politica_cola = politica_cola
+        self.max_retraso_ms = max_retraso_ms
+        
+        self.suscripciones = {}  # Formas de suscripción en uso, por clave
+        
+        # Historial de ciclos recientes para rellenar a los clientes que se conectan. La
+        # secuencia empieza en 1 en cada arranque; la sesión identifica el arranque para que
+        # un cliente que reconecta tras un reinicio sepa que su último seq ya no vale
+        self.sesion = random.SystemRandom().randrange(1, 2**31)
+        self.seq = 0
+        self.historial = deque(maxlen=historial_max)  # (seq, t, valor por sensor)
         
         # Configurar sensores
         self.sensores = {
@@ -48,6 +370,10 @@ class ProcesoIndustrial:
             "ph_reactor": SensorIndustrial("PH1", "ph", "pH", 0, 14, 0.05),
             "conductividad": SensorIndustrial("CD1", "conductividad", "mS/cm", 0, 200, 1)
         }
+        if semilla is not None:
+            rng = random.Random(semilla)
+            for sensor in self.sensores.values():
+                sensor.rng = rng
         
         # Variables de control
         self.setpoints = {
@@ -65,94 +391,186 @@ class ProcesoIndustrial:
             "agitador": False
         }
         
-        # Configuración de red
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # Potencia de cada actuador mientras está encendido (unidades del modelo)
+        self.potencias = {
+            "valvula_entrada": 0.2,
+            "valvula_salida": 0.2,
+            "calentador": 2.0,
+            "agitador": 0.5
+        }
+        
+        # Lazos de control cerrados (vacío: actuadores en manual)
+        self.lazos = []
+        self.energia_consumida = 0.0  # Potencia de los actuadores integrada en el tiempo
         
     def iniciar_proceso(self):
         try:
+            # Configuración de red (solo en modo en línea; la simulación por lotes no usa sockets)
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             self.socket.bind(("127.0.0.1", self.port))
-            self.socket.listen(1)
+            self.socket.listen(5)
             print(f"[PLANTA] Proceso {self.nombre} iniciado en puerto {self.port}")
             
+            # El ciclo de proceso corre en su propio hilo a ritmo fijo; los clientes solo reciben
+            # tramas encoladas, así que un cliente lento nunca frena la simulación ni a los demás
+            hilo_proceso = threading.Thread(target=self.bucle_proceso, daemon=True)
+            hilo_proceso.start()
+            
             while self.running:
                 try:
                     # Configurar socket con timeout para poder cerrar limpiamente
                     self.socket.settimeout(1.0)
                     client_socket, addr = self.socket.accept()
-                    client_socket.settimeout(0.1)  # Timeout más corto para operaciones
+                    client_socket.settimeout(None)  # El envío es bloqueante dentro del hilo del cliente
                     print(f"[PLANTA] Analizador conectado desde {addr}")
                     
-                    # Bucle de comunicación
-                    last_error_time = 0
-                    error_count = 0
+                    cliente = ClientePlanta(client_socket, addr, self.capacidad_cola,
+                                            self.politica_cola, self.max_retraso_ms)
+                    threading.Thread(target=self.atender_cliente, args=(cliente,), daemon=True).start()
                     
-                    while self.running:
-                        try:
-                            # Simular proceso
-                            datos_proceso = self.simular_ciclo()
-                            
-                            # Crear y enviar trama Profinet
-                            trama = self.crear_trama_profinet(datos_proceso)
-                            bytes_enviados = client_socket.send(trama)
-                            
-                            if bytes_enviados == 0:
-                                raise ConnectionError("Conexión cerrada por el cliente")
-                            
-                            # Recibir comandos (no bloqueante)
-                            try:
-                                comando = client_socket.recv(1024)
-                                if comando:
-                                    self.procesar_comando(comando)
-                                else:
-                                    raise ConnectionError("Cliente desconectado")
-                            except socket.timeout:
-                                pass  # Normal en operación no bloqueante
-                            
-                            # Resetear contadores de error si todo va bien
-                            error_count = 0
-                            
-                            time.sleep(0.1)  # Ciclo de proceso
-                            
-                        except (ConnectionError, socket.error) as e:
-                            current_time = time.time()
-                            if current_time - last_error_time > 5:  # Limitar mensajes de error
-                                print(f"[PLANTA] Error de comunicación: {e}")
-                                last_error_time = current_time
-                            
-                            error_count += 1
-                            if error_count > 3:  # Reintentar algunas veces antes de cerrar
-                                break
-                            
-                            time.sleep(0.5)  # Esperar antes de reintentar
-                            
                 except socket.timeout:
                     continue  # Normal en operación de accept() con timeout
                 except Exception as e:
                     print(f"[PLANTA] Error en conexión: {e}")
                     time.sleep(1)
-                finally:
-                    try:
-                        client_socket.close()
-                    except:
-                        pass
                         
         except Exception as e:
             print(f"[PLANTA] Error crítico: {e}")
         finally:
             self.cleanup()
             
-    def simular_ciclo(self):
+    def bucle_proceso(self):
+        """Simula un ciclo cada self.ciclo segundos y encola la trama para todos los clientes"""
+        siguiente = time.monotonic()
+        nan = float("nan")
+        while self.running:
+            t = time.time()
+            datos_proceso = self.simular_ciclo(self.ciclo, t)
+            
+            # Historial y reparto bajo el mismo lock que el registro de clientes: un cliente
+            # nuevo recibe el historial hasta seq N y el directo desde N+1, sin huecos ni duplicados
+            with self.lock_clientes:
+                self.seq += 1
+                datos_proceso["sesion"] = self.sesion
+                datos_proceso["seq"] = self.seq
+                datos_proceso["t"] = round(t, 3)
+                self.historial.append((self.seq, t) + tuple(
+                    nan if datos_proceso[s]["valor"] is None else datos_proceso[s]["valor"] for s in self.sensores))
+                    
+                # Cada forma de suscripción se codifica una vez y la trama se comparte entre sus clientes
+                por_forma = {}
+                for cliente in self.clientes:
+                    por_forma.setdefault(cliente.suscripcion, []).append(cliente)
+                for forma, clientes in por_forma.items():
+                    payload = datos_proceso if forma is None else forma.acumular(datos_proceso)
+                    if payload is None:
+                        continue
+                    trama = self.crear_trama_profinet(payload)
+                    for cliente in clientes:
+                        cliente.encolar(trama)
+                
+            # Plazo absoluto: el ritmo del ciclo no deriva con el tiempo de simulación
+            siguiente += self.ciclo
+            espera = siguiente - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            else:
+                siguiente = time.monotonic()
+                
+    def atender_cliente(self, cliente):
+        """Hilo por cliente: vacía su cola de transmisión y atiende sus comandos"""
+        try:
+            # Saludo opcional: el cliente puede pedir el historial desde su último seq (y sesión),
+            # suscribirse y negociar compresión antes de recibir la primera trama. Se lee hasta
+            # que el saludo termina en un comando completo o pasan 200 ms; sin saludo se envía
+            # el historial completo. Los comandos rechazados se contestan con una trama de error.
+            peticion = {}
+            limite = time.monotonic() + 0.2
+            while True:
+                listos, _, _ = select.select([cliente.socket], [], [], max(0.0, limite - time.monotonic()))
+                if not listos:
+                    break
+                comando = cliente.socket.recv(1024)
+                if not comando:
+                    return  # Cierre normal del cliente (el finally lo registra)
+                for cmd in self.leer_comandos(comando, cliente):
+                    if isinstance(cmd, dict) and "backfill" in cmd:
+                        peticion = cmd["backfill"]  # Se atiende al registrar al cliente, sin huecos
+                    else:
+                        self.ejecutar_comando(cmd, cliente)
+                if not cliente.entrada:
+                    break
+            try:
+                desde, maximo = self.rango_backfill(peticion)
+            except ValueError as e:
+                self.responder_error(cliente, str(e))
+                desde, maximo = 0, None
+                
+            with self.lock_clientes:
+                filas = self.filas_historial(desde, maximo)
+                self.clientes.append(cliente)
+            if filas:
+                cliente.encolar_prioritaria(self.crear_bloque_historial(filas))
+                
+            while self.running and cliente.activo:
+                lote = cliente.siguiente_lote(timeout=0.05)
+                if lote:
+                    cliente.enviar(lote)
+                    
+                # Recibir comandos sin bloquear el envío
+                listos, _, _ = select.select([cliente.socket], [], [], 0)
+                if listos:
+                    comando = cliente.socket.recv(1024)
+                    if not comando:
+                        return  # Cierre normal del cliente (el finally lo registra)
+                    self.procesar_comando(comando, cliente)
+        except (ConnectionResetError, BrokenPipeError):
+            pass  # El cliente cerró con datos pendientes: también es un cierre normal
+        except (ConnectionError, OSError, ValueError) as e:  # ValueError: socket ya cerrado
+            if cliente.activo:
+                print(f"[PLANTA] Error de comunicación con {cliente.addr}: {e}")
+        finally:
+            cliente.cerrar()
+            self.asignar_suscripcion(cliente, None)
+            with self.lock_clientes:
+                if cliente in self.clientes:
+                    self.clientes.remove(cliente)
+            print(f"[PLANTA] Analizador {cliente.addr} desconectado: {cliente.estadisticas()}")
+            
+    def estadisticas_clientes(self):
+        with self.lock_clientes:
+            return [cliente.estadisticas() for cliente in self.clientes]
+            
+    def simular_ciclo(self, dt=0.1, t=None):
+        """Avanza el modelo un paso y devuelve la lectura de todos los sensores"""
+        self.integrar_modelo(dt, time.time() if t is None else t)
+        
+        # Recopilar datos de todos los sensores
         datos = {}
+        for sensor_id, sensor in self.sensores.items():
+            datos[sensor_id] = {
+                "valor": sensor.leer_valor(),
+                "unidad": sensor.unidad,
+                "estado": "ERROR" if sensor.fallo else "OK"
+            }
         
-        # Simular proceso físico más realista
-        dt = 0.1  # Intervalo de tiempo
+        return datos
         
+    def integrar_modelo(self, dt, t):
+        """Integra la física de la planta un intervalo dt en el instante t (reloj real o virtual)"""
+        # 0. Lazos de control sobre los actuadores
+        for lazo in self.lazos:
+            lazo.actualizar(self, dt)
+        for actuador, potencia in self.potencias.items():
+            if self.actuadores[actuador]:
+                self.energia_consumida += potencia * dt
+            
         # 1. Simulación del reactor
         temp_actual = self.sensores["temp_reactor"].valor
         
         # Efecto del calentador (con inercia térmica)
-        potencia_calentador = 2.0 if self.actuadores["calentador"] else 0.0
+        potencia_calentador = self.potencias["calentador"] if self.actuadores["calentador"] else 0.0
         temp_ambiente = 25.0
         
         # Ecuación diferencial simplificada para temperatura
@@ -181,7 +599,7 @@ class ProcesoIndustrial:
         
         # 5. Simulación de pH (afectado por temperatura)
         ph_base = 7.0
-        ph_drift = 0.5 * math.sin(time.time() / 10.0)  # Oscilación lenta
+        ph_drift = 0.5 * math.sin(t / 10.0)  # Oscilación lenta
         temp_effect = 0.2 * (temp_actual - 25) / 25
         self.sensores["ph_reactor"].valor = max(0, min(14, ph_base + ph_drift + temp_effect))
         
@@ -190,15 +608,103 @@ class ProcesoIndustrial:
         temp_factor = 1.0 + 0.02 * (temp_actual - 25)  # Compensación de temperatura
         self.sensores["conductividad"].valor = cond_base * temp_factor
         
-        # Recopilar datos de todos los sensores
-        for sensor_id, sensor in self.sensores.items():
-            datos[sensor_id] = {
-                "valor": sensor.leer_valor(),
-                "unidad": sensor.unidad,
-                "estado": "ERROR" if sensor.fallo else "OK"
-            }
+    def simular_lote(self, duracion, dt=0.1, programa=None, salida=None, t0=0.0):
+        """Simula el proceso sin sockets sobre un reloj virtual, tan rápido como permita la CPU.
         
-        return datos
+        programa: lista de (tiempo, actuador, valor) o (tiempo, comando) que se aplica al
+            alcanzar cada instante; comando es un dict de actuador, setpoint, simular_fallo o
+            reparar como los de procesar_comando.
+        salida: ruta opcional (.csv, .npz o .parquet) donde volcar las trayectorias.
+        El programa y el formato de salida se comprueban antes de simular (ValueError).
+        Devuelve {"tiempo": ..., sensor: ..., actuador: ...} como arrays NumPy
+        (o array.array si NumPy no está instalado). Las lecturas en fallo quedan como NaN.
+        """
+        if salida:
+            from exportador import comprobar_formato
+            comprobar_formato(salida)
+            
+        eventos = self.validar_programa(programa)
+        pasos = int(round(duracion / dt))
+        nombres = ["tiempo"] + list(self.sensores) + list(self.actuadores)
+        columnas = {nombre: array('d', [0.0]) * pasos for nombre in nombres}
+        
+        # Referencias locales para el bucle caliente
+        col_tiempo = columnas["tiempo"]
+        col_sensores = [(columnas[s], sensor) for s, sensor in self.sensores.items()]
+        col_actuadores = [(columnas[a], a) for a in self.actuadores]
+        actuadores = self.actuadores
+        integrar = self.integrar_modelo
+        nan = float("nan")
+        siguiente = 0
+        
+        for i in range(pasos):
+            t = t0 + i * dt
+            while siguiente < len(eventos) and eventos[siguiente][0] <= t:
+                evento = eventos[siguiente]
+                if len(evento) == 2:
+                    self.aplicar_comando(evento[1])
+                else:
+                    actuadores[evento[1]] = evento[2]
+                siguiente += 1
+                
+            integrar(dt, t)
+            col_tiempo[i] = t
+            for col, sensor in col_sensores:
+                valor = sensor.leer_valor()
+                col[i] = nan if valor is None else valor
+            for col, actuador in col_actuadores:
+                col[i] = 1.0 if actuadores[actuador] else 0.0
+        
+        try:
+            import numpy as np
+            columnas = {nombre: np.frombuffer(col, dtype=np.float64) for nombre, col in columnas.items()}
+        except ImportError:
+            pass
+            
+        if salida:
+            self.guardar_lote(columnas, salida)
+        return columnas
+        
+    def validar_programa(self, programa):
+        """Comprueba todos los eventos de un programa por lotes y los devuelve ordenados por tiempo"""
+        if programa is None:
+            return []
+        if not isinstance(programa, list):
+            raise ValueError("El programa debe ser una lista de eventos")
+        for evento in programa:
+            if not isinstance(evento, (list, tuple)) or len(evento) not in (2, 3) \
+                    or not isinstance(evento[0], (int, float)):
+                raise ValueError(f"Evento no válido: {evento} (se espera [tiempo, actuador, valor] o [tiempo, comando])")
+            if len(evento) == 3:
+                self.validar_comando({"actuador": evento[1], "valor": evento[2]})
+            else:
+                self.validar_comando(evento[1])
+        return sorted(programa, key=lambda e: e[0])
+        
+    def validar_comando(self, cmd):
+        """Comandos de proceso admitidos en un programa por lotes (sin cliente ni red)"""
+        if not isinstance(cmd, dict):
+            raise ValueError(f"Comando no válido: {cmd}")
+        if "actuador" in cmd:
+            if cmd["actuador"] not in self.actuadores:
+                raise ValueError(f"Actuador desconocido: {cmd['actuador']} (opciones: {', '.join(self.actuadores)})")
+            if not isinstance(cmd.get("valor"), bool):
+                raise ValueError(f"Valor de actuador no booleano: {cmd}")
+        elif "setpoint" in cmd:
+            if cmd.get("variable") not in self.setpoints:
+                raise ValueError(f"Setpoint desconocido: {cmd.get('variable')} (opciones: {', '.join(self.setpoints)})")
+            if not isinstance(cmd.get("valor"), (int, float)):
+                raise ValueError(f"Valor de setpoint no numérico: {cmd}")
+        elif "simular_fallo" in cmd or "reparar" in cmd:
+            if cmd.get("sensor") not in self.sensores:
+                raise ValueError(f"Sensor desconocido: {cmd.get('sensor')} (opciones: {', '.join(self.sensores)})")
+        else:
+            raise ValueError(f"Comando no admitido en un programa por lotes: {cmd}")
+            
+    def guardar_lote(self, columnas, salida):
+        """Vuelca las trayectorias de simular_lote con el exportador (CSV, NPZ sin NumPy o Parquet)"""
+        from exportador import exportar
+        exportar([columnas], salida)
         
     def crear_trama_profinet(self, datos):
         """Crear una trama Profinet simulada con los datos del proceso"""
@@ -216,19 +722,184 @@ class ProcesoIndustrial:
         
         return header + length + payload
         
-    def procesar_comando(self, comando):
+    def filas_historial(self, desde=0, maximo=None):
+        """Filas del historial con seq > desde (las últimas `maximo` si se indica)"""
+        filas = [fila for fila in self.historial if fila[0] > desde]
+        if maximo is not None:
+            filas = filas[len(filas) - maximo:] if maximo > 0 else []
+        return filas
+        
+    def rango_backfill(self, peticion):
+        """(desde, maximo) de una petición de historial; un seq de otra sesión de la planta no vale aquí"""
+        if not isinstance(peticion, dict):
+            raise ValueError(f"Petición de historial no válida: {peticion}")
+        desde = peticion.get("desde", 0)
+        maximo = peticion.get("max")
+        if not isinstance(desde, (int, float)) or not (maximo is None or isinstance(maximo, int)):
+            raise ValueError(f"Petición de historial no válida: {peticion}")
+        if peticion.get("sesion") not in (None, self.sesion):
+            desde = 0
+        return desde, maximo
+        
+    def crear_bloque_historial(self, filas):
+        """Bloque de historial comprimido: columnas float64 (seq, tiempo, sensores) en una sola trama.
+        
+        Usa EtherType 0x8893 y longitud de 4 bytes porque puede superar los 64 KiB de una trama normal.
+        Payload (zlib): longitud de metadatos (!I) + metadatos JSON + columnas contiguas.
+        """
+        columnas = ["seq", "tiempo"] + list(self.sensores)
+        meta = json.dumps({
+            "columnas": columnas,
+            "sesion": self.sesion,
+            "filas": len(filas),
+            "desde": filas[0][0],
+            "hasta": filas[-1][0],
+            "orden": sys.byteorder,
+            "unidades": {s: sensor.unidad for s, sensor in self.sensores.items()},
+        }).encode()
+        cuerpo = b"".join(array('d', columna).tobytes() for columna in zip(*filas))
+        payload = zlib.compress(struct.pack('!I', len(meta)) + meta + cuerpo)
+        
+        header = struct.pack('!6B', 0x11, 0x22, 0x33, 0x44, 0x88, 0x93)
+        return header + struct.pack('!I', len(payload)) + payload
+        
+    def configurar_control(self, variable, actuador, controlador):
+        """Cierra el lazo variable -> actuador; el setpoint se lee de self.setpoints"""
+        self.lazos = [l for l in self.lazos if l.actuador != actuador]
+        self.lazos.append(LazoControl(variable, actuador, controlador))
+        
+    def leer_comandos(self, comando, cliente=None):
+        """Un recv puede traer varios comandos JSON seguidos y el último puede venir partido: este
+        se guarda en cliente.entrada hasta que llegue el resto. Si uno es ilegible se rechaza el resto."""
+        datos = (cliente.entrada if cliente else b"") + comando
+        fin = fin_comandos(datos)
+        if cliente:
+            cliente.entrada = datos[fin:]
+            if len(cliente.entrada) > MAX_COMANDO:
+                cliente.entrada = b""
+                self.responder_error(cliente, f"Comando de más de {MAX_COMANDO} bytes")
+        texto = datos[:fin].decode(errors="replace")
+        decoder = json.JSONDecoder()
+        pos = 0
+        comandos = []
+        while pos < len(texto):
+            if texto[pos].isspace():
+                pos += 1
+                continue
+            try:
+                cmd, pos = decoder.raw_decode(texto, pos)
+            except ValueError as e:
+                self.responder_error(cliente, f"Comando ilegible: {e}")
+                break
+            comandos.append(cmd)
+        return comandos
+        
+    def procesar_comando(self, comando, cliente=None):
+        for cmd in self.leer_comandos(comando, cliente):
+            self.ejecutar_comando(cmd, cliente)
+            
+    def ejecutar_comando(self, cmd, cliente=None):
+        """Aplica un comando; si es inválido se rechaza con una trama de error y la conexión sigue"""
         try:
-            cmd = json.loads(comando.decode())
-            if "actuador" in cmd:
-                self.actuadores[cmd["actuador"]] = cmd["valor"]
-            elif "setpoint" in cmd:
-                self.setpoints[cmd["variable"]] = cmd["valor"]
-            elif "simular_fallo" in cmd:
-                self.sensores[cmd["sensor"]].simular_fallo()
-            elif "reparar" in cmd:
-                self.sensores[cmd["sensor"]].reparar()
-        except:
-            pass
+            if not isinstance(cmd, dict):
+                raise ValueError("se esperaba un objeto JSON")
+            self.aplicar_comando(cmd, cliente)
+        except KeyError as e:
+            self.responder_error(cliente, f"Comando {json.dumps(cmd)}: falta o no existe {e}")
+        except (TypeError, ValueError) as e:
+            self.responder_error(cliente, f"Comando {json.dumps(cmd)}: {e}")
+            
+    def responder_error(self, cliente, mensaje):
+        """Trama de control {"control": {"error": ...}} por la cola prioritaria del cliente"""
+        print(f"[PLANTA] Comando rechazado{f' de {cliente.addr}' if cliente else ''}: {mensaje}")
+        if cliente:
+            cliente.encolar_prioritaria(self.crear_trama_profinet({"control": {"error": mensaje}}))
+            
+    def suscribir(self, cliente, peticion):
+        """Asigna al cliente una forma de suscripción, compartida con otros clientes iguales.
+        
+        peticion: {"senales": [nombre o id de sensor], "periodo": s | "decimacion": ciclos,
+                   "agregacion": "last" | "mean" | "minmax"}; None vuelve al flujo completo.
+        """
+        if not peticion:
+            self.asignar_suscripcion(cliente, None)
+            return
+        if not isinstance(peticion, dict):
+            raise ValueError("la suscripción debe ser un objeto JSON")
+        por_id = {sensor.id: nombre for nombre, sensor in self.sensores.items()}
+        senales = [por_id.get(s, s) for s in peticion.get("senales") or self.sensores]
+        desconocidas = [s for s in senales if s not in self.sensores]
+        if desconocidas:
+            raise ValueError(f"Señales desconocidas: {desconocidas}")
+        if "periodo" in peticion:
+            decimacion = round(peticion["periodo"] / self.ciclo)
+        else:
+            decimacion = peticion.get("decimacion", 1)
+            
+        self.asignar_suscripcion(cliente, Suscripcion(senales, decimacion, peticion.get("agregacion", "last")))
+        
+    def asignar_suscripcion(self, cliente, forma):
+        """Cambia la forma del cliente (None: flujo completo). Una forma sale del registro solo
+        cuando la deja su último cliente, así la comparten también los que aún están en el saludo."""
+        with self.lock_clientes:
+            anterior = cliente.suscripcion
+            if forma is not None:
+                forma = self.suscripciones.setdefault(forma.clave, forma)
+                forma.clientes += 1
+            cliente.suscripcion = forma
+            if anterior is not None:
+                anterior.clientes -= 1
+                if anterior.clientes == 0:
+                    del self.suscripciones[anterior.clave]
+            
+    def diccionario_compresion(self):
+        """Diccionario zlib precargado: una trama tipo con el esquema (claves, unidades, estados)"""
+        plantilla = {s: {"valor": 0.0, "unidad": sensor.unidad, "estado": "OK"} for s, sensor in self.sensores.items()}
+        plantilla["sesion"] = 0
+        plantilla["seq"] = 0
+        plantilla["t"] = 0.0
+        return self.crear_trama_profinet(plantilla)
+        
+    def negociar_compresion(self, cliente, peticion):
+        """Valida la petición antes de confirmar nada: una petición inválida deja el flujo sin comprimir"""
+        if cliente.compresor is not None:
+            raise ValueError("la compresión ya está activa en esta conexión")
+        if not isinstance(peticion, dict) or not isinstance(peticion.get("nivel", 6), int):
+            raise ValueError(f"Compresión no válida: {peticion}")
+        nivel = peticion.get("nivel", 6)
+        vaciado = peticion.get("vaciado", "lote")
+        if not -1 <= nivel <= 9 or vaciado not in ("trama", "lote"):
+            raise ValueError(f"Compresión no válida: {peticion}")
+        diccionario = self.diccionario_compresion()
+        confirmacion = self.crear_trama_profinet({"control": {"compresion": {
+            "nivel": nivel, "vaciado": vaciado, "diccionario": diccionario.decode("latin-1")}}})
+        cliente.activar_compresion(confirmacion, nivel, vaciado, diccionario)
+        
+    def aplicar_comando(self, cmd, cliente=None):
+        if "compresion" in cmd:
+            if cliente:
+                self.negociar_compresion(cliente, cmd["compresion"])
+        elif "suscribir" in cmd:
+            if cliente:
+                self.suscribir(cliente, cmd["suscribir"])
+        elif "backfill" in cmd:
+            if cliente:
+                with self.lock_clientes:
+                    filas = self.filas_historial(*self.rango_backfill(cmd["backfill"]))
+                if filas:
+                    cliente.encolar_prioritaria(self.crear_bloque_historial(filas))
+        elif "actuador" in cmd:
+            if cmd["actuador"] not in self.actuadores:
+                raise KeyError(cmd["actuador"])
+            self.actuadores[cmd["actuador"]] = cmd["valor"]
+        elif "setpoint" in cmd:
+            self.setpoints[cmd["variable"]] = cmd["valor"]
+        elif "simular_fallo" in cmd:
+            self.sensores[cmd["sensor"]].simular_fallo()
+        elif "reparar" in cmd:
+            self.sensores[cmd["sensor"]].reparar()
+        else:
+            raise ValueError("comando desconocido")
             
     def cleanup(self):
         try:
@@ -236,9 +907,84 @@ class ProcesoIndustrial:
         except:
             pass
         self.running = False
+        with self.lock_clientes:
+            for cliente in self.clientes:
+                cliente.cerrar()
+
+def parsear_control(texto):
+    """VARIABLE[:pid[:KP,KI,KD] | :onoff[:HISTERESIS]] -> (variable, actuador, controlador)"""
+    partes = texto.split(":")
+    variable = partes[0]
+    if variable not in ACTUADOR_POR_VARIABLE:
+        raise ValueError(f"Variable sin lazo de control: {variable} (opciones: {', '.join(ACTUADOR_POR_VARIABLE)})")
+    tipo = partes[1] if len(partes) > 1 else "pid"
+    try:
+        parametros = [float(x) for x in partes[2].split(",")] if len(partes) > 2 else []
+    except ValueError:
+        raise ValueError(f"Parámetros de control no numéricos: {texto}")
+    if tipo == "pid" and len(parametros) <= 3:
+        controlador = ControladorPID(*(parametros or [0.5, 0.05]))
+    elif tipo == "onoff" and len(parametros) <= 1:
+        controlador = ControladorOnOff(*parametros)
+    else:
+        raise ValueError(f"Control no válido: {texto}")
+    return variable, ACTUADOR_POR_VARIABLE[variable], controlador
 
 def main():
-    proceso = ProcesoIndustrial("Reactor Químico")
+    import argparse
+    parser = argparse.ArgumentParser(description="Planta industrial simulada con comunicación Profinet")
+    parser.add_argument("--port", type=int, default=5000, help="Puerto TCP del servidor")
+    parser.add_argument("--cola", type=int, default=50, help="Tramas máximas en la cola de cada cliente")
+    parser.add_argument("--politica", choices=ClientePlanta.POLITICAS, default="descartar_antiguas",
+                        help="Qué hacer cuando un cliente no consume al ritmo del proceso")
+    parser.add_argument("--max-retraso", type=float, default=2000,
+                        help="Retraso (ms) tras el cual se desconecta al cliente con la política desconectar")
+    parser.add_argument("--historial", type=int, default=3000,
+                        help="Ciclos recientes guardados para rellenar a los clientes al conectar")
+    parser.add_argument("--lote", type=float, metavar="SEGUNDOS",
+                        help="Simular SEGUNDOS de proceso sin red sobre un reloj virtual")
+    parser.add_argument("--dt", type=float, default=0.1, help="Paso de integración del modo por lotes")
+    parser.add_argument("--programa", help="JSON con lista de [tiempo, actuador, valor] para el modo por lotes")
+    parser.add_argument("--salida", help="Archivo .csv, .npz o .parquet para las trayectorias del modo por lotes")
+    parser.add_argument("--semilla", type=int, help="Semilla del ruido de sensores")
+    parser.add_argument("--control", action="append", default=[],
+                        metavar="VARIABLE[:pid[:KP,KI,KD]|:onoff[:HISTERESIS]]",
+                        help="Cerrar el lazo de VARIABLE hacia su setpoint (repetible); por defecto PID 0.5,0.05")
+    args = parser.parse_args()
+    
+    proceso = ProcesoIndustrial("Reactor Químico", port=args.port, semilla=args.semilla,
+                                capacidad_cola=args.cola, politica_cola=args.politica,
+                                max_retraso_ms=args.max_retraso, historial_max=args.historial)
+    for texto in args.control:
+        try:
+            proceso.configurar_control(*parsear_control(texto))
+        except ValueError as e:
+            parser.error(str(e))
+            
+    if args.lote is not None:
+        if args.salida:
+            from exportador import comprobar_formato
+            try:
+                comprobar_formato(args.salida)
+            except (RuntimeError, ValueError) as e:
+                parser.error(str(e))
+        programa = None
+        try:
+            if args.programa:
+                with open(args.programa) as f:
+                    programa = json.load(f)
+            proceso.validar_programa(programa)
+        except OSError as e:
+            parser.error(f"No se pudo leer el programa: {e}")
+        except ValueError as e:  # Incluye JSON mal formado
+            parser.error(f"Programa {args.programa}: {e}")
+        inicio = time.perf_counter()
+        columnas = proceso.simular_lote(args.lote, dt=args.dt, programa=programa, salida=args.salida)
+        duracion = time.perf_counter() - inicio
+        pasos = len(columnas["tiempo"])
+        print(f"[PLANTA] {pasos} pasos simulados en {duracion:.2f} s ({pasos / max(duracion, 1e-9):.0f} pasos/s)")
+        return
+        
     try:
         proceso.iniciar_proceso()
     except KeyboardInterrupt:
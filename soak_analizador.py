@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""Prueba de carga sostenida (soak) de la interfaz del analizador.
+
+Levanta una fuente sintética local que emite tramas Profinet a tasas crecientes, conecta
+un AnalizadorProfinet real a ella y, en cada escalón de tasa, mide:
+
+- latencia del bucle de eventos de Tk (retraso de un sondeo periódico con after)
+- FPS de redibujo alcanzados (llamadas a actualizar_graficos)
+- profundidad de la cola entre el hilo de red y la GUI (redibujos programados y no ejecutados)
+- atraso: tramas enviadas y aún no procesadas, en segundos de flujo
+- crecimiento de memoria (RSS)
+- tasa de tramas perdidas: ciclos que la fuente no pudo emitir a tiempo porque el analizador
+  no consumía (TCP no pierde tramas, así que la pérdida real ocurre en la fuente, como en un
+  dispositivo de E/S cíclico; esos ciclos quedan como huecos de seq en el analizador)
+
+y genera un informe que señala el escalón donde la interfaz se satura.
+Necesita pantalla: si no hay DISPLAY y existe Xvfb, se arranca uno automáticamente.
+"""
+import argparse
+import json
+import os
+import select
+import shutil
+import socket
+import subprocess
+import threading
+import time
+
+import analizador_profinet
+from planta_industrial import ProcesoIndustrial
+
+PERIODO_SONDEO = 0.02  # s entre sondeos de latencia del bucle de eventos
+MAX_ATRASO_FUENTE = 0.1  # s de atraso de la fuente a partir del cual se pierden ciclos
+TAM_BUFER_FUENTE = 32 * 1024  # Bytes de búfer de envío de la fuente
+
+# Umbrales de saturación
+MAX_PERDIDA = 0.05
+MAX_LATENCIA_P99_MS = 100.0
+MAX_ATRASO_S = 1.0  # Trabajo pendiente (red o redibujos) en segundos de flujo
+
+
+class FuenteSintetica:
+    """Servidor local que emite tramas de la planta a una tasa configurable.
+
+    Cada ciclo tiene su seq; si el envío se atrasa más de MAX_ATRASO_FUENTE (el analizador no
+    vacía el socket), los ciclos vencidos se pierden y se cuentan en omitidas.
+    """
+    def __init__(self, port):
+        self.port = port
+        self.tasa = 0.0
+        self.enviadas = 0
+        self.omitidas = 0
+        self.running = True
+        self.proceso = ProcesoIndustrial("Soak", semilla=0)
+        self.servidor = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.servidor.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.servidor.bind(("127.0.0.1", port))
+        self.servidor.listen(1)
+        self.hilo = threading.Thread(target=self.emitir, daemon=True)
+        self.hilo.start()
+
+    def emitir(self):
+        self.servidor.settimeout(0.5)
+        cliente = None
+        while self.running and cliente is None:
+            try:
+                cliente, _ = self.servidor.accept()
+            except socket.timeout:
+                continue
+        if cliente is None:
+            return
+        # Búfer de envío pequeño, como un dispositivo de campo: si el analizador no vacía el
+        # socket, el atraso aparece en segundos y no tras varios MB retenidos por el kernel
+        cliente.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, TAM_BUFER_FUENTE)
+
+        siguiente = time.monotonic()
+        try:
+            while self.running:
+                # Descartar comandos del analizador (saludo de historial, etc.)
+                listos, _, _ = select.select([cliente], [], [], 0)
+                if listos and not cliente.recv(4096):
+                    break
+                if self.tasa <= 0:
+                    time.sleep(0.01)
+                    siguiente = time.monotonic()
+                    continue
+
+                periodo = 1.0 / self.tasa
+                atraso = time.monotonic() - siguiente
+                if atraso > MAX_ATRASO_FUENTE:
+                    vencidos = int(atraso / periodo)
+                    self.omitidas += vencidos
+                    siguiente += vencidos * periodo
+
+                datos = self.proceso.simular_ciclo(0.1)
+                datos["sesion"] = self.proceso.sesion
+                datos["seq"] = self.enviadas + self.omitidas + 1
+                datos["t"] = round(time.time(), 3)
+                cliente.sendall(self.proceso.crear_trama_profinet(datos))
+                self.enviadas += 1
+
+                siguiente += periodo
+                espera = siguiente - time.monotonic()
+                if espera > 0:
+                    time.sleep(espera)
+        except OSError:
+            pass
+        finally:
+            cliente.close()
+
+    def detener(self):
+        self.running = False
+        self.servidor.close()
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Pico, no actual
+
+
+def percentil(valores, p):
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p / 100 * len(ordenados)))]
+
+
+class SoakAnalizador:
+    def __init__(self, tasas, duracion_paso, port):
+        self.tasas = tasas
+        self.duracion_paso = duracion_paso
+        self.fuente = FuenteSintetica(port)
+
+        analizador_profinet.cargar_gui()
+        self.root = analizador_profinet.tk.Tk()
+        self.app = analizador_profinet.AnalizadorProfinet(self.root, "127.0.0.1", port)
+        self.root.protocol("WM_DELETE_WINDOW", self.terminar)
+        self.instrumentar()
+
+        self.resultados = []
+        self.retrasos = []
+        self.paso = -1
+        self.error = None
+
+    def instrumentar(self):
+        """Cuenta redibujos programados/ejecutados sin modificar el analizador.
+
+        Cada trama programa dos after_idle (gráficos y estadísticas); solo se cuentan los
+        redibujos, así la cola equivale a tramas pendientes de pintar.
+        """
+        self.redibujos = 0
+        self.programadas = 0  # Solo lo incrementa el hilo de red
+        self.ejecutadas = 0   # Solo lo incrementa el hilo de la GUI
+
+        actualizar_graficos = self.app.actualizar_graficos
+        def graficos_contados():
+            self.redibujos += 1
+            actualizar_graficos()
+        self.app.actualizar_graficos = graficos_contados
+
+        after_idle = self.root.after_idle
+        def after_idle_contado(func, *args):
+            if func is not graficos_contados:
+                return after_idle(func, *args)
+            self.programadas += 1
+            def envoltura():
+                self.ejecutadas += 1
+                func(*args)
+            return after_idle(envoltura)
+        self.root.after_idle = after_idle_contado
+
+    def ejecutar(self):
+        self.root.after(200, self.conectar)
+        self.root.mainloop()
+        return self.resultados
+
+    def conectar(self):
+        self.app.toggle_connection()
+        if not self.app.connected:
+            self.error = "El analizador no pudo conectarse a la fuente sintética"
+            self.terminar()
+            return
+        self.sondear(time.perf_counter() + PERIODO_SONDEO)
+        self.iniciar_paso(0)
+
+    def sondear(self, esperado):
+        ahora = time.perf_counter()
+        self.retrasos.append((ahora - esperado) * 1000)
+        self.cola_max = max(self.cola_max, self.programadas - self.ejecutadas) if self.paso >= 0 else 0
+        self.root.after(int(PERIODO_SONDEO * 1000), self.sondear, ahora + PERIODO_SONDEO)
+
+    def iniciar_paso(self, i):
+        self.paso = i
+        self.fuente.tasa = self.tasas[i]
+        self.inicio = {
+            "t": time.perf_counter(),
+            "enviadas": self.fuente.enviadas,
+            "omitidas": self.fuente.omitidas,
+            "procesadas": self.app.profinet_tramas,
+            "redibujos": self.redibujos,
+            "rss": rss_mb(),
+        }
+        self.retrasos = []
+        self.cola_max = 0
+        self.root.after(int(self.duracion_paso * 1000), self.cerrar_paso)
+
+    def cerrar_paso(self):
+        duracion = time.perf_counter() - self.inicio["t"]
+        tasa = self.tasas[self.paso]
+        enviadas = self.fuente.enviadas - self.inicio["enviadas"]
+        omitidas = self.fuente.omitidas - self.inicio["omitidas"]
+        procesadas = self.app.profinet_tramas - self.inicio["procesadas"]
+        cola = self.programadas - self.ejecutadas
+        en_vuelo = self.fuente.enviadas - self.app.profinet_tramas
+        resultado = {
+            "tasa_objetivo": tasa,
+            "enviadas_s": enviadas / duracion,
+            "procesadas_s": procesadas / duracion,
+            "perdida": omitidas / (enviadas + omitidas) if enviadas + omitidas else 0.0,
+            "en_vuelo": en_vuelo,
+            "atraso_s": en_vuelo / tasa,
+            "redibujo_fps": (self.redibujos - self.inicio["redibujos"]) / duracion,
+            "latencia_p50_ms": percentil(self.retrasos, 50),
+            "latencia_p99_ms": percentil(self.retrasos, 99),
+            "latencia_max_ms": max(self.retrasos, default=0.0),
+            "cola_gui": cola,
+            "cola_gui_max": max(self.cola_max, cola),
+            "rss_mb": rss_mb(),
+            "rss_crecimiento_mb": rss_mb() - self.inicio["rss"],
+        }
+        self.resultados.append(resultado)
+        print(formatear_fila(resultado), flush=True)
+
+        if self.paso + 1 < len(self.tasas) and self.app.connected:
+            self.iniciar_paso(self.paso + 1)
+        else:
+            self.terminar()
+
+    def terminar(self):
+        self.fuente.tasa = 0
+        self.fuente.detener()
+        self.app.on_closing()
+
+
+def motivos_saturacion(resultado):
+    motivos = []
+    if resultado["perdida"] > MAX_PERDIDA:
+        motivos.append(f"pérdida {resultado['perdida'] * 100:.1f}%")
+    if resultado["latencia_p99_ms"] > MAX_LATENCIA_P99_MS:
+        motivos.append(f"latencia p99 {resultado['latencia_p99_ms']:.0f} ms")
+    if resultado["atraso_s"] > MAX_ATRASO_S:
+        motivos.append(f"atraso de red {resultado['atraso_s']:.1f} s")
+    if resultado["cola_gui"] > resultado["tasa_objetivo"] * MAX_ATRASO_S:
+        motivos.append(f"cola GUI {resultado['cola_gui']} redibujos")
+    return motivos
+
+
+def saturado(resultado):
+    return bool(motivos_saturacion(resultado))
+
+
+CABECERA = (f"{'tasa':>6} {'env/s':>7} {'proc/s':>7} {'pérdida':>8} {'atraso':>7} {'fps':>6} "
+            f"{'lat p50':>8} {'lat p99':>8} {'lat max':>8} {'cola':>6} {'RSS MB':>7} {'ΔRSS':>6}")
+
+
+def formatear_fila(r):
+    return (f"{r['tasa_objetivo']:>6.0f} {r['enviadas_s']:>7.1f} {r['procesadas_s']:>7.1f} "
+            f"{r['perdida'] * 100:>7.1f}% {r['atraso_s']:>6.2f}s {r['redibujo_fps']:>6.1f} "
+            f"{r['latencia_p50_ms']:>8.1f} {r['latencia_p99_ms']:>8.1f} {r['latencia_max_ms']:>8.1f} "
+            f"{r['cola_gui_max']:>6} {r['rss_mb']:>7.1f} {r['rss_crecimiento_mb']:>+6.1f}")
+
+
+def informe(resultados):
+    lineas = ["", "RESUMEN"]
+    saturacion = next((r for r in resultados if saturado(r)), None)
+    sostenibles = [r for r in resultados if not saturado(r)]
+    if sostenibles:
+        lineas.append(f"Tasa máxima sostenida: {sostenibles[-1]['tasa_objetivo']:.0f} tramas/s")
+    if saturacion:
+        lineas.append(f"Saturación a {saturacion['tasa_objetivo']:.0f} tramas/s: "
+                      f"{', '.join(motivos_saturacion(saturacion))}")
+    else:
+        lineas.append("Sin saturación en el rango probado")
+    if resultados:
+        crecimiento = resultados[-1]["rss_mb"] - resultados[0]["rss_mb"] + resultados[0]["rss_crecimiento_mb"]
+        lineas.append(f"Crecimiento de memoria durante la prueba: {crecimiento:+.1f} MB")
+    return "\n".join(lineas)
+
+
+def asegurar_pantalla():
+    """Arranca un Xvfb si no hay DISPLAY; devuelve el proceso para detenerlo al final"""
+    if os.environ.get("DISPLAY") or not shutil.which("Xvfb"):
+        return None
+    pantalla = ":97"
+    xvfb = subprocess.Popen(["Xvfb", pantalla, "-screen", "0", "1600x900x24"],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.environ["DISPLAY"] = pantalla
+    time.sleep(0.5)
+    return xvfb
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga sostenida de la interfaz del analizador")
+    parser.add_argument("--tasas", default="10,20,50,100,200,500",
+                        help="Tramas/s de cada escalón, separadas por comas")
+    parser.add_argument("--duracion", type=float, default=20.0, help="Segundos por escalón")
+    parser.add_argument("--port", type=int, default=5099, help="Puerto local de la fuente sintética")
+    parser.add_argument("--json", help="Guardar los resultados por escalón en este archivo")
+    args = parser.parse_args()
+
+    xvfb = asegurar_pantalla()
+    try:
+        soak = SoakAnalizador([float(t) for t in args.tasas.split(",")], args.duracion, args.port)
+        print(CABECERA, flush=True)
+        resultados = soak.ejecutar()
+    finally:
+        if xvfb:
+            xvfb.terminate()
+
+    if soak.error:
+        print(f"[SOAK] {soak.error}")
+    print(informe(resultados))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(resultados, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()